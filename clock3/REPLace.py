@@ -45,8 +45,12 @@ includes = []
 includes.append('boot.py')
 includes.append('main.py')
 includes.append('npxy.py')
+includes.append('npxy_font.py')
+includes.append('npxy_viper.py')
+includes.append('npsched.py')
 includes.append('nettools.py')
 includes.append('wget.py')
+includes.append('sntp.py')
 includes.append('clock3.py')
 
 # The following variable reduces upload size.
@@ -36,20 +36,61 @@ mode = 1
 xoffset = -1
 yoffset = -1
 
-# colors
+# font
+font_file = None # binary font file (see npxy.NPXY.save_font), None = built-in
+
+# colors (full scale, scaled to mcvalue once on import)
 mcvalue      = 8
-mcscale      = mcvalue/255
-notify_red   = tuple([int(round(x*mcscale,0)) for x in (255,0,0)])
-notify_green = tuple([int(round(x*mcscale,0)) for x in (0,255,0)])
-clock_bg     = tuple([int(round(x*mcscale,0)) for x in (0,0,0)])
-clock_fg     = tuple([int(round(x*mcscale,0)) for x in (0,0,255)])
-wave_water   = tuple([int(round(x*mcscale,0)) for x in (0,0,128)])
-wave_foam    = tuple([int(round(x*mcscale,0)) for x in (128,128,255)])
+gamma        = 1 # LED gamma correction, 1 = none
+notify_red   = (255,0,0)
+notify_green = (0,255,0)
+status_rtc   = (255,255,0) # time kept by the RTC, not synced yet
+status_saved = (255,127,0) # time from the state file, not synced yet
+clock_bg     = (0,0,0)
+clock_fg     = (0,0,255)
+wave_water   = (0,0,128)
+wave_foam    = (128,128,255)
 wave_sand    = clock_bg
 
+# night dimming (whole grid, applied at write time)
+night_start      = 22 # hour
+night_end        = 6 # hour
+night_brightness = 128 # 0-255, 255 = no dimming
+
+# network time (SNTP, see sntp.py and CLOCK.sync_time, runs in the background)
+time_servers = ['pool.ntp.org','time.google.com','time.cloudflare.com'] # fastest answer wins
+time_zone = -5 # hours from UTC (standard time)
+time_dst = 'us' # daylight saving time rule, 'us', 'eu', or None
+sync_interval = 3600 # seconds between network time updates (at least)
+sync_interval_max = 86400 # seconds, doubles up to this while drift is in tolerance
+sync_tolerance = 1000 # ms, RTC offset allowed at a sync (after drift correction)
+drift_history = 8 # sync intervals used for the drift estimate
+drift_max_ppm = 10000 # a larger offset is not drift (e.g. a missed time change), not used
+sync_retry = 300 # seconds between updates while the time is not okay
+sync_connect_timeout = 30 # seconds
+sync_fetch_timeout = 2 # seconds per try
+sync_tries = 10
+sync_try_pause = 3 # seconds
+sync_disconnect_timeout = 10 # seconds
+
+# state file (last known time, drift, and sync data, see CLOCK.save_state)
+state_file = 'clock3.state' # None = don't save
+state_interval = 60 # minutes between saves (plus one after every sync)
+time_valid_year = 2024 # an RTC year before this was never set
+
+# clock loop (sleeps between deadlines)
+clock_lightsleep = True # use machine.lightsleep (if there is one)
+clock_lightsleep_min = 20 # ms, shorter waits use a normal sleep
+clock_minute_poll = 50 # ms, check for the minute change in the last second
+
+# time grids
+tgrid_prebuild = False # make all 720 at start (faster, uses memory)
+
 # wave
 wave_pause = 4.44 # between wave starts
-wave_surprise = 444
+wave_surprise = 444 # every this many waves, a second wave follows
+wave_surprise_color = 'red' # its water (a palette color name)
+wave_surprise_delay = 600 # ms after the first
 wave_rfactor = 1.6 # radius multiplier time grid width
 wave_steps = 15 # steps (moves) up, then down
 wave_min_height = 3
@@ -62,35 +103,87 @@ wave_x_start_max = 7
 #---------------------------------------------------------------
 
 # imports
-import time, npxy
+import os, time, struct, npxy, npsched
+from npsched import asyncio
+import machine
 from machine import RTC
 from math import sqrt
+from array import array
 
 # this kills all network connections on import
-from nettools import wlan_connect, wlan_disconnect
-from wget import wget
+from nettools import wlan_connect_async, wlan_disconnect_async
+import sntp
+
+# light sleep (not on all ports)
+lightsleep = getattr(machine,'lightsleep',None)
 
 # random
 print('RANDOM 1:',npxy.randint())
 
+# scale colors
+palette      = npxy.Palette(mcvalue,gamma)
+notify_red   = palette.scale(notify_red)
+notify_green = palette.scale(notify_green)
+status_rtc   = palette.scale(status_rtc)
+status_saved = palette.scale(status_saved)
+clock_bg     = palette.scale(clock_bg)
+clock_fg     = palette.scale(clock_fg)
+wave_water   = palette.scale(wave_water)
+wave_foam    = palette.scale(wave_foam)
+wave_sand    = palette.scale(wave_sand)
+
 #---------------------------------------------------------------
 # functions
 #---------------------------------------------------------------
 
 class CLOCK:
 
-    def __init__(self):
+    def __init__(self,start=True):
 
-        # make grid
-        self.npg = npxy.NPXY(pin,width,height,colors,timing,mode,xoffset,yoffset)
-        self.npg.random_flash(255,100,fast=True)
-        self.notify('reset',notify_red)
+        # start = False only sets up (for npsim.py and testing)
 
-        # must have times to start
+        # make grid
+        self.npg = npxy.NPXY(pin,width,height,colors,timing,mode,xoffset,yoffset,fontfile=font_file)
+
+        # layers (the grid itself is the sand)
+        self.text = self.npg.add_layer('text') # time digits, redrawn only when the time changes
+        self.water = self.npg.add_layer('water') # the wave, clear above the foam line
+        self.status = self.npg.add_layer('status') # error dot
+        self.text_grid = None # last grid and color set (see set_text)
+        self.text_color = None
+        self.text_mask = (1 << self.npg.width) - 1
+
+        # time grids (see tgrid)
+        self.glyphs = {}
+        self.tgrids = {}
+        self.last_tgrid = None
+        self.tgrids_prebuilt = False
+        if tgrid_prebuild:
+            self.prebuild_tgrids()
+        self.arcs = None # see wave_table
+        self.wave_dropped = 0 # wave steps skipped by late frames
+        self.duty = [time.ticks_ms(),0,0] # see duty_stats
+        self.sync_state = 'idle' # see sync_time
+        self.next_sync = None
+        self.sync_wait = sync_interval # see drift
+        self.sync_secs = None
+        self.offsets = []
+        self.ppm = 0
+        self.corrected = 0
+        self.rtc_dst = 0 # seconds the RTC is ahead for daylight saving time
+
+        # time_ok = synced since boot
+        # time_source = 'sntp', 'rtc', 'saved', or None (see restore)
         self.rtc = RTC()
         self.time_ok = False
-        while not self.time_ok:
-            self.get_times(notify=True)
+        self.time_source = None
+        if not start:
+            return
+
+        # show the time now, sync in the background
+        if not self.restore():
+            self.npg.random_flash(255,100,fast=True)
+            self.notify('no time',notify_red)
 
         # start clock loop
         self.clock_loop()
@@ -98,92 +191,412 @@ class CLOCK:
     def notify(self,text,color=(1,0,0)):
         print('NOTIFY:',text)
         text = text.split()
+        self.npg.show_layers(False)
         for word in text:
             self.npg.clear()
             self.npg.center_text(word,color)
             self.npg.write()
             time.sleep(0.8)
         self.npg.off()
+        self.npg.show_layers(True)
 
-    def get_times(self,notify=False):
+    def time_at(self,result):
 
-        # reset status
-        self.time_ok = False
+        # result = sntp query result
+        # return = (ticks_ms of the next whole second, local datetime tuple then,
+        #           daylight saving time seconds in it)
+        # set machine.RTC().datetime at that time (the RTC has whole seconds)
 
-        # notify
-        if notify:
-            self.notify('get time',notify_green)
+        ms,ticks,rtt,server = result
+        now = ms + time.ticks_diff(time.ticks_ms(),ticks)
+        wait = 1000 - now%1000
+        print('SNTP:',server,'rtt',rtt,'ms')
 
-        # connect to network
-        connected = wlan_connect(essid,password,timeout=30)
+        now += wait
 
-        # no connect
-        if not connected:
-            wlan_disconnect(timeout=15)
-            if notify:
-                self.notify('no inet',notify_red)
-            return False
+        return time.ticks_add(time.ticks_ms(),wait),sntp.rtc_tuple(now,time_zone,time_dst),self.dst_shift(now//1000)
 
-        # get times
-        print('Read Times...',end=' ')
-        for x in range(10):
-            try:
-                # IMPORTANT: there is no guarantee I won't kill this service
-                headers,response = wget('http://symple.design/cgi-bin/ztime.py?TZ=New_York',None,True,True,1024)
-                response = response.strip().split(b'\n')[-1]
-                year,month,day,hour,minute,second = [int(x) for x in response.split()[:6]]
-                self.rtc.datetime((year,month,day,None,hour,minute,second,0))
-                self.time_ok = True
-                print('okay',end=' ')
-                break
-                # old method used npttime module
-                #self.ntptime = ntptime.time()
-                #self.cputime = time.time()
-                #self.time_ok = True
-                #print('okay',end=' ')
-                #break
-            except:
+    def dst_shift(self,utc):
+
+        # daylight saving time seconds at UTC seconds utc
+
+        if time_dst and sntp.is_dst(utc,time_zone,time_dst):
+            return 3600
+        return 0
+
+    def clock_loop(self):
+
+        # run the clock tasks (forever)
+
+        self.sched = npsched.Scheduler()
+        self.sched.run(self.clock_main())
+
+    async def clock_main(self):
+
+        # time sync runs in the background (see sync_task)
+
+        self.sched.start('sync',self.sync_task())
+
+        await self.clock_task()
+
+    async def sync_task(self):
+
+        # update network time every self.sync_wait seconds
+        # (every sync_retry seconds while the time is not okay)
+
+        # first sync right away
+        wait = 0
+
+        while 1:
+            self.next_sync = time.ticks_add(time.ticks_ms(),wait*1000)
+            await npsched.sleep_until(self.next_sync)
+            self.next_sync = None # running, nothing to wake the clock loop for
+            await self.sync_time()
+            self.show_status()
+            wait = self.sync_wait if self.time_ok else sync_retry
+
+    async def sync_time(self):
+
+        # states: connect > fetch (tries) > disconnect > apply > idle
+        # every network wait is async with a timeout, so the
+        # clock and the wave keep going while this runs
+        # the new time is set in one RTC call, at the next whole second
+        # (after the radio is off, the answer is kept against ticks_ms)
+
+        result = None
+
+        try:
+
+            # connect to network
+            self.sync_state = 'connect'
+            if not await wlan_connect_async(essid,password,sync_connect_timeout):
                 self.time_ok = False
-                print('wait',end=' ')
-                time.sleep(3)
-        print('done.')
+                return False
+
+            # get times
+            self.sync_state = 'fetch'
+            for x in range(sync_tries):
+                try:
+                    result = await sntp.query_async(time_servers,sync_fetch_timeout*1000)
+                except OSError as e:
+                    print('SYNC:',repr(e))
+                if result:
+                    break
+                print('SYNC: wait')
+                await asyncio.sleep(sync_try_pause)
 
         # disconnect
-        wlan_disconnect(timeout=10)
+        finally:
+            self.sync_state = 'disconnect'
+            await wlan_disconnect_async(sync_disconnect_timeout)
+            self.sync_state = 'idle'
 
-        # notify
-        if notify:
-            if self.time_ok:
-                self.notify('time okay',notify_green)
-            else:
-                self.notify('time error',notify_red)
-            
-    def clock_loop(self):
+        if not result:
+            self.time_ok = False
+            return False
+
+        # measure the RTC against it (see drift), then set it
+        self.sync_state = 'apply'
+        try:
+            if self.sync_secs is not None:
+                self.drift(await self.rtc_offset(result))
+            due,dt,dst = self.time_at(result)
+            await npsched.sleep_until(due)
+            self.set_time(dt,dst)
+            self.time_ok = True
+            print('SYNC: okay')
+        finally:
+            self.sync_state = 'idle'
+
+        return True
+
+    def set_time(self,dt,dst):
+
+        # set the RTC, start counting drift from here
+        # dst = daylight saving time seconds in dt
+
+        self.rtc.datetime(dt)
+        self.rtc_dst = dst
+        self.sync_secs = self.rtc_secs()
+        self.corrected = 0
+        self.time_source = 'sntp'
+        self.save_state()
+
+    def rtc_secs(self):
+
+        # RTC time (local) as seconds since the epoch
+
+        year,month,day,weekday,hour,minute,second,subsec = self.rtc.datetime()
+
+        return sntp.seconds(year,month,day,hour,minute,second)
+
+    def rtc_utc(self,secs):
+
+        # RTC seconds (local) to UTC seconds
+
+        return secs - int(time_zone*3600) - self.rtc_dst
+
+    async def rtc_offset(self,result):
+
+        # ms the RTC is behind the sntp result (- = ahead)
+        # the RTC subsecond units vary by port, so this waits
+        # for the RTC second to change and measures there
+        # (in UTC, so a daylight saving time change is not drift)
+
+        ms,ticks,rtt,server = result
+        start = time.ticks_ms()
+        secs = self.rtc_secs()
+        while time.ticks_diff(time.ticks_ms(),start) < 1100:
+            await asyncio.sleep(0.005)
+            now = self.rtc_secs()
+            if now != secs:
+                break
+        edge = time.ticks_ms()
+
+        true = ms+time.ticks_diff(edge,ticks)
+
+        return true - self.rtc_utc(now)*1000
+
+    def drift(self,offset):
+
+        # RTC drift (ppm) from the offset at this sync
+        # offsets = (seconds, ms the RTC lost) per sync interval
+        # corrections (see correct_drift) are added back, so this
+        # is the raw drift, the offset is what is left after them
+
+        elapsed = self.rtc_secs() - self.sync_secs
+        if elapsed > 0 and abs(offset+self.corrected)*1000 > elapsed*drift_max_ppm:
+            print('DRIFT: offset {} ms in {} s is too much for drift, not used'.format(offset,elapsed))
+        elif elapsed > 0:
+            self.offsets.append((elapsed,offset+self.corrected))
+            self.offsets = self.offsets[-drift_history:]
+            self.ppm = sum([x[1] for x in self.offsets])*1000/sum([x[0] for x in self.offsets])
+
+        # stretch the sync interval while the offset is in tolerance
+        if abs(offset) <= sync_tolerance:
+            self.sync_wait = min(self.sync_wait*2,sync_interval_max)
+        else:
+            self.sync_wait = max(self.sync_wait//2,sync_interval)
+
+        print('DRIFT: offset {} ms, corrected {} ms, {:.1f} ppm, next sync {} s'.format(offset,self.corrected,self.ppm,self.sync_wait))
+
+    def correct_drift(self):
+
+        # step the RTC a whole second when the drift adds up to one
+        # (call just after the RTC second changes, setting it loses
+        # the subseconds)
+
+        if not self.ppm or self.sync_secs is None:
+            return
+
+        secs = self.rtc_secs()
+        step = int((self.ppm*(secs-self.sync_secs)/1000 - self.corrected)/1000)
+        if step:
+            year,month,day,hour,minute,second,weekday,yearday = time.gmtime(secs+step)[:8]
+            self.rtc.datetime((year,month,day,weekday,hour,minute,second,0))
+            self.corrected += step*1000
+            print('DRIFT: step',step,'s')
+
+    def correct_dst(self):
+
+        # step the RTC an hour at a daylight saving time change
+        # (without waiting for a sync, they can be a day apart)
+        # return = True if it was stepped
+
+        if not time_dst or self.time_source is None:
+            return False
+
+        secs = self.rtc_secs()
+        dst = self.dst_shift(self.rtc_utc(secs))
+        if dst == self.rtc_dst:
+            return False
+
+        step = dst - self.rtc_dst
+        year,month,day,hour,minute,second,weekday,yearday = time.gmtime(secs+step)[:8]
+        self.rtc.datetime((year,month,day,weekday,hour,minute,second,0))
+        self.rtc_dst = dst
+        if self.sync_secs is not None:
+            self.sync_secs += step # the drift is counted in RTC seconds
+        print('DST: step',step,'s')
+        return True
+
+    def show_status(self):
+
+        # time confidence mark in lower right corner (status layer)
+        # none = synced, yellow = RTC, orange = state file, red = no time
+
+        if self.time_ok:
+            self.status.clearp(self.npg.width,1)
+        elif self.time_source == 'rtc':
+            self.status.setp(self.npg.width,1,*status_rtc)
+        elif self.time_source == 'saved':
+            self.status.setp(self.npg.width,1,*status_saved)
+        else:
+            self.status.setp(self.npg.width,1,*notify_red)
+        self.npg.write()
+
+    #-----------------------------------------------------------
+    # state file
+    #-----------------------------------------------------------
+
+    # Binary state file (little-endian):
+    #
+    #   header = 'CLK3', version (B), saved time (q), last sync time (q, -1 = none),
+    #            drift ppm (f), sync wait seconds (I), drift corrected ms (i), offsets (B)
+    #   offsets = offsets x (seconds (I), ms (i)) (see drift)
+    #
+    # Times are RTC (local) seconds since the epoch.
+
+    def save_state(self):
+
+        # written to a temp file first, a power cut leaves the old one
+
+        if not state_file:
+            return
+
+        try:
+            with open(state_file+'.tmp','wb') as f:
+                f.write(struct.pack('<4sBqqfIiB',b'CLK3',1,self.rtc_secs(),
+                                    -1 if self.sync_secs is None else self.sync_secs,
+                                    self.ppm,self.sync_wait,self.corrected,len(self.offsets)))
+                for elapsed,ms in self.offsets:
+                    f.write(struct.pack('<Ii',elapsed,ms))
+            os.rename(state_file+'.tmp',state_file)
+        except OSError as e:
+            print('STATE: not saved',repr(e))
+
+    def load_state(self):
+
+        # return = (saved time, last sync time, ppm, sync wait, corrected, offsets) or None
+        # (a short file is no good, e.g. cut off by a power loss)
+
+        try:
+            with open(state_file,'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < 34:
+            return None
+        magic,version,saved,synced,ppm,wait,corrected,count = struct.unpack_from('<4sBqqfIiB',data)
+        if magic != b'CLK3' or version != 1 or len(data) < 34+count*8:
+            return None
+        offsets = [struct.unpack_from('<Ii',data,34+x*8) for x in range(count)]
+
+        return saved,(None if synced < 0 else synced),ppm,wait,corrected,offsets
+
+    def restore(self):
+
+        # pick up the time from the RTC (it keeps going through a
+        # reset or deep sleep) or else the state file, and the drift
+        # data from the state file
+        # return = True if there is a time to show
+
+        state = None
+        if state_file:
+            state = self.load_state()
+
+        # drift estimate and sync interval
+        if state:
+            saved,synced,self.ppm,self.sync_wait,corrected,self.offsets = state
+            self.sync_wait = max(sync_interval,min(self.sync_wait,sync_interval_max))
+
+        # RTC still good (continue drift correction from the last sync)
+        if self.rtc.datetime()[0] >= time_valid_year:
+            self.time_source = 'rtc'
+            if state and synced is not None and saved <= self.rtc_secs():
+                self.sync_secs,self.corrected = synced,corrected
+
+        # last saved time (stale by the time the power was off)
+        elif state:
+            self.time_source = 'saved'
+            year,month,day,hour,minute,second,weekday,yearday = time.gmtime(saved)[:8]
+            self.rtc.datetime((year,month,day,weekday,hour,minute,second,0))
+
+        # daylight saving time in the RTC (as it would have been set)
+        if self.time_source:
+            secs = self.rtc_secs() - int(time_zone*3600)
+            self.rtc_dst = self.dst_shift(secs-3600)
+
+        print('RESTORE:',self.time_source,self.rtc.datetime()[:7],'drift',self.ppm,'ppm')
+
+        return self.time_source is not None
+
+    async def sleep_until(self,due):
+
+        # sleep until ticks_ms due, light sleep if long enough
+        # (nothing else runs between clock deadlines, unless a
+        # time sync is working, then the sleep must let it run)
+
+        # this always yields, even when due is past (a late deadline
+        # must not keep sync_task from running)
+
+        start = time.ticks_ms()
+        wait = time.ticks_diff(due,start)
+        if clock_lightsleep and lightsleep and wait >= clock_lightsleep_min and self.sync_state == 'idle':
+            lightsleep(wait)
+        await npsched.sleep_until(due) # (after a light sleep, lets due tasks run)
+        self.duty[1] += time.ticks_diff(time.ticks_ms(),start)
+        self.duty[2] += 1
+
+    def duty_stats(self,reset=False):
+
+        # (ms, ms asleep, wakes, busy percent) since the last reset
+        # asleep = clock loop sleeps plus wave waits between frames
+        # (npsched.frame_sleep), busy = drawing and writing
+
+        start,slept,wakes = self.duty
+        slept += npsched.frame_sleep[0]
+        wakes += npsched.frame_sleep[1]
+        total = max(1,time.ticks_diff(time.ticks_ms(),start))
+        stats = (total,slept,wakes,100*(total-slept)/total)
+
+        if reset:
+            self.duty = [time.ticks_ms(),0,0]
+            npsched.frame_sleep[0] = npsched.frame_sleep[1] = 0
+
+        return stats
+
+    async def clock_task(self):
 
         # time format machine.RTC().datetime = (year,month,day,weekday,hour,min,second,subsecond)
 
+        # The loop only wakes when something is due: the next minute
+        # (polled every clock_minute_poll ms in the last second, the
+        # RTC subsecond units vary by port), the next wave, or the
+        # next time sync (so sync_task gets to run after a light
+        # sleep). In between it sleeps (see sleep_until).
+
         lasttime = (0,0) 
-        lastwave = 0
-        lastcheck = 0
+        polled = False
         timegrid = self.tgrid('')
+        shown = False
         full = True
         wavecount = 0
+        nextwave = time.ticks_ms()
+        self.duty_stats(True)
+        self.show_status()
 
         while 1:
 
             # current time
             year,month,day,weekday,hour,minute,second,subsec = self.rtc.datetime()
-            nowsecs = time.ticks_ms()/1000
-
-            # update network time
-            if time.time() - lastcheck >= 3600:
-                self.get_times(notify=False)
-                lastcheck = time.time()
-                nowsecs = time.ticks_ms()/1000
 
             # time changed
             if (hour,minute) != lasttime:
                 print('CHANGE:',lasttime,'==>',(hour,minute))
+                sent,skipped = self.npg.write_stats(True)
+                print('FRAMES: sent {}, skipped {}, wave steps dropped {}'.format(sent,skipped,self.wave_dropped))
+                print('DUTY: {} ms, {} ms asleep, {} wakes, busy {:.1f}%'.format(*self.duty_stats(True)))
+                self.wave_dropped = 0
+
+                # drift and time change corrections, only right after
+                # the RTC second changed (setting it loses the subseconds)
+                if polled and self.sync_state == 'idle':
+                    self.correct_drift()
+                    if self.correct_dst():
+                        polled = False
+                        continue # show the new hour
 
                 # get time grid
                 ghour = hour
@@ -196,145 +609,360 @@ class CLOCK:
                 tstring = '{}:{:0>2}'.format(ghour,minute)
                 timegrid = self.tgrid(tstring)
 
+                # the first time goes up now, not at the first wave's peak
+                if not shown:
+                    self.set_text(timegrid,clock_fg)
+                    shown = True
+
+                # dim at night
+                if night_start > night_end:
+                    night = hour >= night_start or hour < night_end
+                else:
+                    night = night_start <= hour < night_end
+                self.npg.brightness(night_brightness if night else 255)
+
                 # change with full wave
                 full = True
 
                 # update time
                 lasttime = (hour,minute)
 
+                # save the state now and then (the RTC time, for a cold boot)
+                if (hour*60+minute) % state_interval == 0:
+                    self.save_state()
+
             # need to do a wave
-            if nowsecs >= lastwave + wave_pause:
+            if time.ticks_diff(time.ticks_ms(),nextwave) >= 0:
+                nextwave = time.ticks_add(time.ticks_ms(),int(wave_pause*1000))
+                r = self.npg.width*wave_rfactor
+                waves = [Wave(r,self.npg.width,wave_water,wave_foam,full)]
                 if wavecount == wave_surprise:
-                    surprise = (8,0,0) # npxy.randRGB(mcvalue)
-                    self.wave(timegrid,clock_fg,surprise,wave_foam,wave_sand,wave_steps-5)
+                    surprise = palette.get(wave_surprise_color)
+                    waves.append(Wave(r,self.npg.width,surprise,wave_foam,wave_steps-5,wave_surprise_delay))
                     wavecount = 0
-                else:
-                    self.wave(timegrid,clock_fg,wave_water,wave_foam,wave_sand,full)
-                lastwave = nowsecs
+                frames = self.waves_frames(timegrid,clock_fg,wave_sand,waves)
+                self.sched.animate('wave',frames)
+                await self.sched.wait('wave')
                 full = False
                 wavecount += 1
+                polled = False
+                continue # the minute may have changed
 
-            # no change
+            # next deadline
+            polled = second >= 59
+            if second < 59:
+                due = time.ticks_add(time.ticks_ms(),(59-second)*1000)
             else:
-                pass
+                due = time.ticks_add(time.ticks_ms(),clock_minute_poll)
+            for x in (nextwave,self.next_sync):
+                if x is not None and time.ticks_diff(x,due) < 0:
+                    due = x
+            await self.sleep_until(due)
 
-            # add error mark to lower left corner
-            if not self.time_ok:
-                self.npg.setp(self.npg.width,1,*notify_red)
-                self.npg.write()
+    def wave(self,tgrid,tcolor,water,foam,sand,full=False):
 
-            # delay
-            time.sleep(0.1)
+        self.npg.play(self.wave_frames(tgrid,tcolor,water,foam,sand,full))
 
-    def wave(self,tgrid,tcolor,water,foam,sand,full=False):
+    def wave_frames(self,tgrid,tcolor,water,foam,sand,full=False):
 
-        # setup
-        r = self.npg.width*wave_rfactor
-        ysteps = wave_steps
-        if full:
-            if type(full) == int:
-                cy = -r - npxy.randint(ysteps-full)
-            else:
-                cy = -r
-            cx = wave_x_start_max/2
-        else:
-            cy = -r - npxy.randint(ysteps-wave_min_height)
-            cx = wave_x_start_min + npxy.randint(wave_x_start_max-wave_x_start_min)
-        cx2 = self.npg.width - cx
-        xchange = (cx2-cx)/(ysteps+1+ysteps)
-        ychange = 1
-        pbase = wave_step_pause_base
-        wait_until = 0       
-
-        # move circle up cys steps
-        for step in range(ysteps):
-            while time.ticks_ms()/1000 < wait_until:
-                time.sleep(0.001)
-            wait_until = (time.ticks_ms()/1000) + (pbase*step**2) 
-            cy += ychange
-            cx += xchange
-            for x in range(self.npg.width):
-                y = int(round(sqrt(abs(r**2-(x-cx)**2))+cy,0))
-                if y >= 0:
-                    if y <= self.npg.height-1:
-                        self.npg.setpzf(x,y,foam)
-                    for y2 in (y-1,y-2):
-                        if 0 <= y2 <= self.npg.height-1:
-                            self.npg.setpzf(x,y2,water)
+        # frame generator for one wave (see waves_frames)
+
+        wave = Wave(self.npg.width*wave_rfactor,self.npg.width,water,foam,full)
+
+        return self.waves_frames(tgrid,tcolor,sand,[wave])
+
+    def waves_frames(self,tgrid,tcolor,sand,waves):
+
+        # frame generator (see npxy.NPXY.play), waves = Wave list
+
+        # The wave only draws the moving foam line on the water layer.
+        # Below the foam is water, above it is clear, so the text
+        # layer and the sand (grid) show through where it recedes.
+        # New text is set at the first peak, while the water covers it.
+
+        # Each wave's position is a function of the time since the
+        # start (see Wave), so a late frame skips to where the waves
+        # should be now (dropping steps) instead of slowing them down.
+        # Where waves overlap, the highest one shows.
+
+        arcs = self.wave_table(waves[0].r)
+        start = time.ticks_ms()
+
+        # start with receded water on sand
+        self.npg.fill(*sand)
+        self.water.clear()
+        tops = [-1]*self.npg.width
+        owners = [None]*self.npg.width
+
+        while 1:
+
+            # where the waves are now
+            now = time.ticks_diff(time.ticks_ms(),start)
+            lines = []
+            due = None
+            for wave in waves:
+                self.wave_dropped += wave.steps_to(now)
+                if wave.step >= 0:
+                    if wave.step >= wave.peak:
+                        self.set_text(tgrid,tcolor)
+                    lines.append(wave.line())
+                if wave.step < wave.last:
+                    when = wave.times[wave.step+1]
+                    if due is None or when < due:
+                        due = when
+
+            # draw
+            self.wave_line(tops,owners,lines,arcs)
             self.npg.write()
 
-        # peak
-        while time.ticks_ms()/1000 < wait_until:
-            time.sleep(0.001)
-        wait_until = (time.ticks_ms()/1000) + (pbase*step**2) 
-        cx += xchange
+            # done (all waves receded)
+            if due is None:
+                break
+
+            yield time.ticks_add(start,due)
+
+    def wave_table(self,r):
+
+        # circle arc heights for radius r, made once per radius
+        # index = distance from the center in 1/8 columns
+        # value = sqrt(abs(r**2-d**2)) in 1/256 rows
+
+        if self.arcs and self.arcs[0] == r:
+            return self.arcs[1]
+
+        size = (self.npg.width + max(abs(wave_x_start_min),abs(wave_x_start_max)) + 2) * 8
+        arcs = [int(round(sqrt(abs(r**2-(i/8)**2))*256,0)) for i in range(size)]
+        arcs = array('H' if max(arcs) < 65536 else 'I',arcs)
+
+        self.arcs = (r,arcs)
+
+        return arcs
+
+    def wave_line(self,tops,owners,lines,arcs):
+
+        # move the foam line, tops = last foam y for each column
+        # owners = the line that drew each column (its colors)
+        # lines = (cx,cy,water,foam) for each wave, cx,cy = circle
+        # center in 1/256 columns/rows, arcs = wave_table
+        # only the pixels between the old and new line change
+        # (or the whole column if the water color changes)
+
+        layer = self.water
+        height = self.npg.height
+        last = len(arcs) - 1
         for x in range(self.npg.width):
-            y = int(round(sqrt(abs(r**2-(x-cx)**2))+cy,0))
-            if y >= 0:
-                if y <= self.npg.height-1:
-                    self.npg.setpzf(x,y,foam)
-                for y2 in (y+1,y+2):
-                    if 0 <= y2 <= self.npg.height-1:
-                        if tgrid[y2][x] == 'X':
-                            self.npg.setpzf(x,y2,tcolor)
-                        else:
-                            self.npg.setpzf(x,y2,sand)
-        self.npg.write()
-            
-        # move circle down cys steps
-        for step in range(ysteps-1,-2,-1):
-            while time.ticks_ms()/1000 < wait_until:
-                time.sleep(0.001)
-            wait_until = (time.ticks_ms()/1000) + (pbase*step**2) 
-            cy -= ychange
-            cx += xchange
-            for x in range(self.npg.width):
-                y = int(round(sqrt(abs(r**2-(x-cx)**2))+cy,0))
-                if 0 <= y <= self.npg.height-1:
-                    self.npg.setpzf(x,y,foam)
-                # corner error 
-                if x <= 3:
-                    if 0 <= y+3 <= self.npg.height-1:
-                        if tgrid[y+3][x] == 'X':
-                            self.npg.setpzf(x,y+3,tcolor)
-                        else:
-                            self.npg.setpzf(x,y+3,sand)
-                # normal
-                for y2 in (y+1,y+2):
-                    if 0 <= y2 <= self.npg.height-1:
-                        if tgrid[y2][x] == 'X':
-                            self.npg.setpzf(x,y2,tcolor)
-                        else:
-                            self.npg.setpzf(x,y2,sand)
-            self.npg.write()
+            y,line = -1,None
+            x8 = x << 8
+            for l in lines:
+                y2 = (arcs[min(abs(x8-l[0])>>5,last)] + l[1] + 128) >> 8
+                if line is None or y2 > y:
+                    y,line = y2,l
+            if line is None:
+                continue
+            top = tops[x]
+            water,foam = line[2],line[3]
+            if owners[x] is None or owners[x][2] != water:
+                for y2 in range(0,min(y,height)):
+                    layer.setpzf(x,y2,water)
+                for y2 in range(max(y+1,0),min(top+1,height)):
+                    layer.clearpzf(x,y2)
+            elif y > top:
+                for y2 in range(max(top,0),min(y,height)):
+                    layer.setpzf(x,y2,water)
+            elif y < top:
+                for y2 in range(max(y+1,0),min(top+1,height)):
+                    layer.clearpzf(x,y2)
+            if 0 <= y < height:
+                layer.setpzf(x,y,foam)
+            tops[x] = y
+            owners[x] = line
+
+    def set_text(self,tgrid,tcolor):
+
+        # redraw the text layer only if the time grid changed,
+        # and then only the pixels that changed (see tgrid)
+
+        if tgrid is self.text_grid and tcolor == self.text_color:
+            return
+        old = self.text_grid
+        if old is None or tcolor != self.text_color:
+            self.text.clear()
+            old = ()
+        self.text_grid = tgrid
+        self.text_color = tcolor
+
+        layer = self.text
+        for y in range(min(len(tgrid),self.npg.height)):
+            row = tgrid[y]
+            changed = (row ^ (old[y] if y < len(old) else 0)) & self.text_mask
+            x = 0
+            while changed:
+                if changed & 1:
+                    if row >> x & 1:
+                        layer.setpzf(x,y,tcolor)
+                    else:
+                        layer.clearpzf(x,y)
+                changed >>= 1
+                x += 1
+
+    def glyph(self,c):
+
+        # cached glyph for char c = (width, rows (bit x = column x, bottom row first))
+
+        glyph = self.glyphs.get(c)
+
+        if glyph is None:
+            c2,cwidth,cindex = self.npg.chars[c]
+            cols = self.npg.fontcols[cindex:cindex+cwidth]
+            rows = tuple([sum([(m >> y & 1) << x for x,m in enumerate(cols)]) for y in range(self.npg.chars['height'])])
+            glyph = self.glyphs[c] = (cwidth,rows)
+
+        return glyph
 
     def tgrid(self,text):
 
-        # text
-        text = self.npg.fix_text(text,smash=True,strip=True,upper=True)
+        # time grid for text (centered, one blank row above and below)
+        # = tuple of row bitmasks, bottom row first, bit x = column x
 
-        # yshift
-        char_height = self.npg.chars['height']
-        if char_height >= self.npg.height:
-            yshift = 0
-        else:
-            yshift = int( (self.npg.height - char_height) // 2 )
+        # prebuilt or the last one
+        tgrid = self.tgrids.get(text)
+        if tgrid is not None:
+            return tgrid
+
+        # text (the clock only uses cached glyphs, skip fixing it)
+        for c in text:
+            if c not in self.glyphs:
+                text = self.npg.fix_text(text,smash=True,strip=True,upper=True)
+                break
+        glyphs = [self.glyph(c) for c in text]
 
         # xshift
-        tlen = sum([self.npg.chars[c][1] for c in text]) + len(text) - 1
+        tlen = sum([g[0] for g in glyphs]) + len(text) - 1
         xshift = int( (self.npg.width - tlen) // 2 )
 
+        # place the glyphs
+        places = []
+        x = xshift
+        for g in glyphs:
+            places.append((x,g))
+            x += g[0] + 1
+
+        # same layout as the last one, re-blit only the changed glyphs
+        height = self.npg.chars['height']
+        last = self.last_tgrid
+        if last and len(last[1]) == len(places) and all([a[0] == b[0] for a,b in zip(last[1],places)]):
+            rows = list(last[0][1:height+1])
+            for (x,old),(x2,new) in zip(last[1],places):
+                if old is not new:
+                    for y in range(height):
+                        rows[y] ^= self.shift(old[1][y],x) ^ self.shift(new[1][y],x)
+        else:
+            rows = [0]*height
+            for x,g in places:
+                for y in range(height):
+                    rows[y] |= self.shift(g[1][y],x)
+
         # grid
-        tgrid = [' '*xshift for x in range(char_height)]
-        for c in text:
-            c2,cwidth,cindex = self.npg.chars[c]
-            for y in range(char_height-1,-1,-1):
-                tgrid[y] += self.npg.font[y][cindex:cindex+cwidth] + ' '
-        xshift = ' '*(self.npg.width - len(tgrid[-1]))
-        tgrid = [x+xshift for x in tgrid]                             
-        tgrid.insert(0,' '*self.npg.width)
-        tgrid.append(tgrid[0])
+        tgrid = tuple([0] + rows + [0])
+        if self.last_tgrid and not self.tgrids_prebuilt:
+            self.tgrids.pop(self.last_tgrid[2],None)
+        self.tgrids[text] = tgrid
+        self.last_tgrid = (tgrid,places,text)
 
         # done
         return tgrid
 
+    def shift(self,row,x):
+
+        # glyph row to column x (may be off the grid)
+
+        return row << x if x >= 0 else row >> -x
+
+    def prebuild_tgrids(self):
+
+        # make all 720 12-hour time grids now (uses memory)
+
+        for hour in range(1,13):
+            for minute in range(60):
+                self.tgrid('{}:{:0>2}'.format(hour,minute))
+                self.last_tgrid = None
+        self.tgrids_prebuilt = True
+
+#---------------------------------------------------------------
+# waves
+#---------------------------------------------------------------
+
+class Wave:
+
+    # One wave for CLOCK.waves_frames.
+
+    # The circle center moves up steps, holds at the peak, and
+    # moves back down, while it moves left to right. Step k is
+    # due at times[k] ms after the start (the pauses grow as
+    # pause_base*step**2 near the peak, like a real wave).
+
+    # r = circle radius (the same for all waves drawn together)
+    # width = grid width
+    # full = True for a full wave, int = random height from this, else random
+    # delay = ms after the start of waves_frames
+
+    def __init__(self,r,width,water,foam,full=False,delay=0,
+                 x_start_min=wave_x_start_min,x_start_max=wave_x_start_max,
+                 min_height=wave_min_height,steps=wave_steps,pause_base=wave_step_pause_base):
+
+        self.r = r
+        self.water = water
+        self.foam = foam
+
+        # start position
+        if full:
+            if type(full) == int:
+                cy = -r - npxy.randint(steps-full)
+            else:
+                cy = -r
+            cx = x_start_max/2
+        else:
+            cy = -r - npxy.randint(steps-min_height)
+            cx = x_start_min + npxy.randint(x_start_max-x_start_min)
+        xchange = (width-cx-cx)/(steps+1+steps)
+
+        # positions in 1/256 columns/rows
+        self.cx = int(round(cx*256))
+        self.cy = int(round(cy*256))
+        self.xchange = int(round(xchange*256))
+
+        # heights (in rows) and due times (ms) of each step
+        self.heights = list(range(1,steps+1)) + [steps] + list(range(steps-1,-2,-1))
+        pauses = [x for x in range(steps)] + [steps-1] + list(range(steps-1,-1,-1))
+        self.times = [delay]
+        for x in pauses:
+            self.times.append(self.times[-1]+int(pause_base*x**2*1000))
+
+        self.peak = steps
+        self.last = len(self.heights) - 1
+        self.step = -1
+
+    def steps_to(self,now):
+
+        # move to the last step due at now (ms)
+        # return = steps dropped (passed over, not counting this one,
+        # or any due at the same time as it, they are never shown)
+
+        start = self.step
+        while self.step < self.last and self.times[self.step+1] <= now:
+            self.step += 1
+
+        dropped = 0
+        for x in range(start+1,self.step):
+            if self.times[x] < self.times[self.step]:
+                dropped += 1
+
+        return dropped
+
+    def line(self):
+
+        # (cx,cy,water,foam) at the current step
+
+        return (self.cx + (self.step+1)*self.xchange,
+                self.cy + self.heights[self.step]*256,
+                self.water,self.foam)
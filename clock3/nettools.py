@@ -6,7 +6,11 @@
 print('LOAD: nettools.py')
 
 # imports
-import time,network,gc
+import sys,time,network,gc
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 gc.collect()
 
 # setup on import
@@ -42,9 +46,16 @@ def wlan_connect(essid,password,timeout=15):
     print('Network Connect:',essid,return_value)
     return return_value
 
+# close idle wget keep-alive sockets (if wget is loaded at all)
+def wget_close():
+    wget = sys.modules.get('wget')
+    if wget:
+        wget.pool_close()
+
 # disconnect from WiFi AP
 def wlan_disconnect(timeout=15):
     print('Network Disconnect')
+    wget_close()
     wlan = network.WLAN(network.STA_IF)
     return_value = True
     if wlan.active():
@@ -59,3 +70,39 @@ def wlan_disconnect(timeout=15):
     wlan.active(False)
     print('Network Disonnect:',return_value)
     return return_value
+
+# async versions, wait without blocking other tasks (e.g. animations)
+# timeout = seconds
+
+async def wlan_connect_async(essid,password,timeout=15):
+    print('Network Connect:',essid)
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    if not wlan.isconnected():
+        wlan.connect(essid,password)
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(),start) < timeout*1000:
+            if wlan.isconnected():
+                break
+            await asyncio.sleep(0.25)
+    return_value = wlan.isconnected()
+    print('Network Connect:',essid,return_value)
+    return return_value
+
+async def wlan_disconnect_async(timeout=15):
+    print('Network Disconnect')
+    wget_close()
+    wlan = network.WLAN(network.STA_IF)
+    return_value = True
+    if wlan.active():
+        if wlan.isconnected():
+            wlan.disconnect()
+            start = time.ticks_ms()
+            while time.ticks_diff(time.ticks_ms(),start) < timeout*1000:
+                if not wlan.isconnected():
+                    break
+                await asyncio.sleep(0.25)
+            return_value = not wlan.isconnected()
+    wlan.active(False)
+    print('Network Disonnect:',return_value)
+    return return_value
@@ -0,0 +1,224 @@
+# npbench.py
+
+# notify
+print('LOAD: npbench.py')
+
+#---------------------------------------------------------------
+# Benchmarks for the NPXY and CLOCK drawing hot paths
+#---------------------------------------------------------------
+
+# Runs on a host (CPython) using the npsim.py stand-ins.
+# The strip write time is NOT emulated here (see npsim.py for that),
+# so these numbers are the drawing cost only.
+
+#     python3 npbench.py [results.json] [compare.json]
+
+# For each grid size and serpentine mode (1-4) it reports:
+#   per call us = setp, setpzf, place_text, center_text,
+#                 tgrid (a new time each call, as the clock does)
+#                 tgrid_full (no last grid to re-blit from)
+#   frames/sec  = scroll_text and one clock wave, without sleeping
+#                 (a fake ticks_ms jumps to each frame's deadline)
+#   per frame   = us, and allocated bytes (tracemalloc, the peak
+#                 above each frame's start), and for the run, the
+#                 peak traced memory and the net memory blocks left
+#                 behind (should be 0)
+
+# Results are written as JSON. Given a previous results file,
+# anything more than 'slower' (25%) slower is listed.
+
+#---------------------------------------------------------------
+# Imports
+#---------------------------------------------------------------
+
+import sys, time, json, tracemalloc
+
+import npsim
+npsim.install(False,None,False)
+
+import clock3
+
+#---------------------------------------------------------------
+# Variables
+#---------------------------------------------------------------
+
+sizes = [(27,9),(32,8),(64,16),(128,32)]
+modes = [1,2,3,4]
+calls = 2000 # per call tests
+runs = 3 # best of
+slower = 1.25
+
+#---------------------------------------------------------------
+# Timing
+#---------------------------------------------------------------
+
+def per_call(function,count=calls):
+
+    # best of runs, us per call
+
+    best = None
+    for run in range(runs):
+        start = time.perf_counter()
+        for x in range(count):
+            function(x)
+        t = (time.perf_counter()-start)*1000000/count
+        if best is None or t < best:
+            best = t
+    return round(best,3)
+
+def per_frame(grid,frames):
+
+    # run a frame generator without sleeping,
+    # time per frame (a frame = a write) and memory for the run
+
+    # time-based generators read ticks_ms, so a fake clock is
+    # put in that moves to each deadline as it is yielded
+    # (the frames are the real ones, without the real waits)
+
+    ticks_ms = time.ticks_ms
+    now = [ticks_ms()]
+    time.ticks_ms = lambda: now[0]
+
+    try:
+        sent = grid.frames_sent
+        blocks = sys.getallocatedblocks()
+        allocated = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        while 1:
+            # bytes allocated making this frame
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            due = next(frames,StopIteration)
+            allocated += tracemalloc.get_traced_memory()[1]-before
+            if due is StopIteration:
+                break
+            if due is not None and time.ticks_diff(due,now[0]) > 0:
+                now[0] = due
+        t = time.perf_counter()-start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        count = max(1,grid.frames_sent-sent)
+    finally:
+        time.ticks_ms = ticks_ms
+
+    return {'frames':count,
+            'fps':round(count/t,1),
+            'us_per_frame':round(t*1000000/count,1),
+            'alloc_bytes_per_frame':round(allocated/count,1),
+            'peak_bytes':peak,
+            'blocks_left':sys.getallocatedblocks()-blocks}
+
+#---------------------------------------------------------------
+# Benchmarks
+#---------------------------------------------------------------
+
+def tgrid_full(clock,text):
+
+    # tgrid with nothing cached but the glyphs
+    clock.tgrids.clear()
+    clock.last_tgrid = None
+    return clock.tgrid(text)
+
+def bench(width,height,mode):
+
+    # the clock reads these at setup
+    clock3.width = width
+    clock3.height = height
+    clock3.mode = mode
+    clock = clock3.CLOCK(start=False)
+    grid = clock.npg
+    color = clock3.clock_fg
+
+    result = {}
+
+    # pixels
+    result['setp_us'] = per_call(lambda x: grid.setp(x%width+1,x//width%height+1,*color))
+    result['setpzf_us'] = per_call(lambda x: grid.setpzf(x%width,x//width%height,color))
+
+    # text
+    result['place_text_us'] = per_call(lambda x: grid.place_text('12:34',color),calls//10)
+    result['center_text_us'] = per_call(lambda x: grid.center_text('12:34',color),calls//10)
+    times = ['{}:{:0>2}'.format(hour,minute) for hour in range(1,13) for minute in range(60)]
+    result['tgrid_us'] = per_call(lambda x: clock.tgrid(times[x%len(times)]),calls//10)
+    result['tgrid_full_us'] = per_call(lambda x: tgrid_full(clock,times[x%len(times)]),calls//10)
+
+    # animations
+    result['scroll_text'] = per_frame(grid,grid.scroll_frames('The time is 12:34',color,rate=1000000))
+    timegrid = clock.tgrid('12:34')
+    per_frame(grid,clock.wave_frames(timegrid,color,clock3.wave_water,clock3.wave_foam,clock3.wave_sand,True))
+    result['wave'] = per_frame(grid,clock.wave_frames(timegrid,color,clock3.wave_water,clock3.wave_foam,clock3.wave_sand,True))
+
+    grid.off()
+
+    return result
+
+def bench_all():
+
+    results = {'python':sys.version.split()[0],'date':time.strftime('%Y-%m-%d %H:%M:%S'),'grids':{}}
+
+    for width,height in sizes:
+        for mode in modes:
+            name = '{}x{}m{}'.format(width,height,mode)
+            print('BENCH:',name)
+            results['grids'][name] = bench(width,height,mode)
+
+    return results
+
+def flatten(results):
+
+    # {'27x9m1 wave us_per_frame': value, ...} (times only)
+
+    flat = {}
+    for name,result in results['grids'].items():
+        for key,value in result.items():
+            if type(value) == dict:
+                flat[name+' '+key+' us_per_frame'] = value['us_per_frame']
+            else:
+                flat[name+' '+key] = value
+    return flat
+
+def compare(results,old):
+
+    # list slower results
+
+    new = flatten(results)
+    old = flatten(old)
+    slow = []
+    for key,value in new.items():
+        if old.get(key) and value > old[key]*slower:
+            slow.append((key,old[key],value))
+    return slow
+
+def report(results):
+
+    print('{:<12} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+        'grid','setp','setpzf','place','center','tgrid','tgrid new','scroll fps','wave fps','wave B/f'))
+    for name,r in results['grids'].items():
+        print('{:<12} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+            name,r['setp_us'],r['setpzf_us'],r['place_text_us'],r['center_text_us'],r['tgrid_us'],r['tgrid_full_us'],
+            r['scroll_text']['fps'],r['wave']['fps'],r['wave']['alloc_bytes_per_frame']))
+
+#---------------------------------------------------------------
+# Run
+#---------------------------------------------------------------
+
+def main(outfile='npbench.json',oldfile=None):
+
+    results = bench_all()
+    report(results)
+
+    with open(outfile,'w') as f:
+        json.dump(results,f,indent=1,sort_keys=True)
+    print('SAVED:',outfile)
+
+    if oldfile:
+        with open(oldfile) as f:
+            slow = compare(results,json.load(f))
+        for key,a,b in slow:
+            print('SLOWER: {} {} -> {}'.format(key,a,b))
+        if slow:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
@@ -0,0 +1,113 @@
+# npsched.py
+
+# notify
+print('LOAD: npsched.py')
+
+#---------------------------------------------------------------
+# Imports
+#---------------------------------------------------------------
+
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+#---------------------------------------------------------------
+# Frames
+#---------------------------------------------------------------
+
+# A frame generator (see NPXY.play) yields the time.ticks_ms() time
+# its next frame is due. These run one as a coroutine instead, so
+# other tasks get the CPU while it waits (no busy-wait loops).
+
+async def sleep_until(due):
+
+    wait = time.ticks_diff(due,time.ticks_ms())
+
+    # always yield, even if late
+    await asyncio.sleep(max(0,wait)/1000)
+
+# ms frame tasks spent waiting between frames, and the waits
+# (for duty cycles, e.g. CLOCK.duty_stats, reset by the reader)
+frame_sleep = [0,0]
+
+async def run_frames(frames):
+
+    try:
+        for due in frames:
+            start = time.ticks_ms()
+            await sleep_until(due)
+            frame_sleep[0] += time.ticks_diff(time.ticks_ms(),start)
+            frame_sleep[1] += 1
+    finally:
+        frames.close()
+
+#---------------------------------------------------------------
+# Scheduler
+#---------------------------------------------------------------
+
+class Scheduler:
+
+    # Runs named asyncio tasks (uasyncio on the device).
+
+    # start(name,coro) = start coroutine as task name (replaces a running one)
+    # animate(name,frames) = start frame generator as task name
+    # cancel(name) = cancel task name (if running)
+    # running(name) = True if task name is running
+    # wait(name) = await task name finishing
+    # run(coro) = run the event loop with coro as the main task (blocking)
+
+    def __init__(self):
+
+        self.tasks = {}
+        self.done = {}
+
+    def start(self,name,coro):
+
+        self.cancel(name)
+        done = self.done[name] = asyncio.Event()
+        task = self.tasks[name] = asyncio.create_task(self.task(name,coro,done))
+
+        return task
+
+    def animate(self,name,frames):
+
+        return self.start(name,run_frames(frames))
+
+    async def task(self,name,coro,done):
+
+        try:
+            await coro
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self.done.get(name) is done:
+                del self.tasks[name]
+                del self.done[name]
+            done.set()
+
+    def cancel(self,name):
+
+        task = self.tasks.pop(name,None)
+        if task:
+            del self.done[name]
+            task.cancel()
+
+    def running(self,name):
+
+        return name in self.tasks
+
+    async def wait(self,name):
+
+        # wait on an event, not the task itself, so cancelling
+        # the waiting task doesn't cancel the one it waits for
+
+        done = self.done.get(name)
+        if done:
+            await done.wait()
+
+    def run(self,coro):
+
+        asyncio.run(coro)
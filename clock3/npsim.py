@@ -0,0 +1,405 @@
+# npsim.py
+
+# notify
+print('LOAD: npsim.py')
+
+#---------------------------------------------------------------
+# Host (CPython) stand-in for the MicroPython hardware modules
+#---------------------------------------------------------------
+
+# This lets npxy.py and clock3.py run on a Linux box.
+# Call install() BEFORE importing them:
+
+#     import npsim
+#     npsim.install()
+#     import npxy
+
+# install() adds these modules (only the parts this code uses):
+#   machine  = Pin, RTC, Timer, lightsleep, idle, reset
+#   neopixel = NeoPixel, records every write() as a frame
+#   network  = WLAN (always connects, the host has the network)
+#   uselect  = select
+# and adds the MicroPython ticks and sleep functions to time.
+
+# Every NeoPixel.write() is recorded as (ticks_ms,pin,bytes) in
+# npsim.frames (keep_frames=True) and/or a log file (logfile=name,
+# see read_log). With wire_time=True, write() takes as long as the
+# real strip would (about 30 us per RGB pixel at 800 kHz), so frame
+# rates and duty cycles are like the real thing. stats() reports them.
+
+# Run as a script to measure the clock wave animation:
+#   python3 npsim.py [waves] [logfile]
+
+#---------------------------------------------------------------
+# Imports
+#---------------------------------------------------------------
+
+import sys, time, struct, types
+
+#---------------------------------------------------------------
+# Ticks (MicroPython time functions)
+#---------------------------------------------------------------
+
+TICKS_PERIOD = 1 << 30
+TICKS_HALF = TICKS_PERIOD >> 1
+
+start = time.monotonic()
+
+def ticks_ms():
+
+    return int((time.monotonic()-start)*1000) % TICKS_PERIOD
+
+def ticks_us():
+
+    return int((time.monotonic()-start)*1000000) % TICKS_PERIOD
+
+def ticks_add(ticks,delta):
+
+    return (ticks+delta) % TICKS_PERIOD
+
+def ticks_diff(ticks1,ticks2):
+
+    return ((ticks1-ticks2+TICKS_HALF) % TICKS_PERIOD) - TICKS_HALF
+
+def sleep_ms(ms):
+
+    if ms > 0:
+        counters['slept_us'] += int(ms*1000)
+        time.sleep(ms/1000)
+
+def sleep_us(us):
+
+    if us > 0:
+        counters['slept_us'] += int(us)
+        time.sleep(us/1000000)
+
+#---------------------------------------------------------------
+# Frame capture and stats
+#---------------------------------------------------------------
+
+frames = []
+keep_frames = True
+wire_time = True
+log = None
+
+counters = {'start':0,'frames':0,'wire_us':0,'slept_us':0}
+
+def reset_stats():
+
+    counters['start'] = ticks_us()
+    counters['frames'] = 0
+    counters['wire_us'] = 0
+    counters['slept_us'] = 0
+    del frames[:]
+
+def stats():
+
+    # elapsed = since reset_stats()
+    # wire = time spent sending to strips
+    # slept = time spent in time.sleep_ms/sleep_us
+    # busy = everything else (drawing, Python)
+
+    elapsed = max(1,ticks_diff(ticks_us(),counters['start']))
+    wire = counters['wire_us']
+    slept = counters['slept_us']
+
+    return {'elapsed_ms':elapsed/1000,
+            'frames':counters['frames'],
+            'fps':counters['frames']*1000000/elapsed,
+            'wire_ms':wire/1000,
+            'slept_ms':slept/1000,
+            'busy_ms':max(0,elapsed-wire-slept)/1000,
+            'wire_duty':wire/elapsed,
+            'busy_duty':max(0,elapsed-wire-slept)/elapsed}
+
+def record(pin,buf):
+
+    ms = ticks_ms()
+    counters['frames'] += 1
+
+    if keep_frames:
+        frames.append((ms,pin,bytes(buf)))
+
+    if log:
+        log.write(struct.pack('<IBH',ms,pin,len(buf)))
+        log.write(buf)
+
+def read_log(logfile):
+
+    # generate (ticks_ms,pin,bytes) frames from a log file
+
+    with open(logfile,'rb') as f:
+        if f.read(6) != b'NPSIM1':
+            raise ValueError('not an npsim log: {}'.format(logfile))
+        while 1:
+            head = f.read(7)
+            if len(head) < 7:
+                break
+            ms,pin,size = struct.unpack('<IBH',head)
+            yield ms,pin,f.read(size)
+
+#---------------------------------------------------------------
+# machine
+#---------------------------------------------------------------
+
+class Pin:
+
+    IN = 0
+    OUT = 1
+
+    def __init__(self,id,mode=-1,*args,**kwargs):
+
+        self.id = id
+        self.mode = mode
+        self.state = 0
+
+    def init(self,mode=-1,*args,**kwargs):
+
+        self.mode = mode
+
+    def value(self,value=None):
+
+        if value is None:
+            return self.state
+        self.state = 1 if value else 0
+
+    def on(self):
+
+        self.state = 1
+
+    def off(self):
+
+        self.state = 0
+
+class RTC:
+
+    # host clock plus an offset, set with datetime()
+
+    offset = 0
+
+    def datetime(self,dt=None):
+
+        if dt is None:
+            now = time.time() + RTC.offset
+            t = time.localtime(int(now))
+            subsec = int((now%1)*1000000)
+            return (t[0],t[1],t[2],t[6],t[3],t[4],t[5],subsec)
+
+        year,month,day,weekday,hour,minute,second,subsec = dt
+        then = time.mktime((year,month,day,hour,minute,second,0,0,-1))
+        RTC.offset = then + (subsec or 0)/1000000 - time.time()
+
+class Timer:
+
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    # callbacks run in a thread (like an interrupt would)
+
+    def __init__(self,id=-1,**kwargs):
+
+        self.thread = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self,mode=PERIODIC,period=-1,callback=None,freq=None):
+
+        import threading
+        self.deinit()
+        if freq:
+            period = 1000/freq
+
+        def run():
+            while self.thread is me:
+                time.sleep(period/1000)
+                if self.thread is not me:
+                    break
+                if callback:
+                    callback(self)
+                if mode == Timer.ONE_SHOT:
+                    break
+
+        me = threading.Thread(target=run,daemon=True)
+        self.thread = me
+        me.start()
+
+    def deinit(self):
+
+        self.thread = None
+
+def lightsleep(ms=None):
+
+    sleep_ms(ms or 0)
+
+def idle():
+
+    time.sleep(0.001)
+
+def reset():
+
+    raise SystemExit('machine.reset()')
+
+#---------------------------------------------------------------
+# neopixel
+#---------------------------------------------------------------
+
+class NeoPixel:
+
+    # same as MicroPython's neopixel.py, but write() records
+
+    ORDER = (1,0,2,3)
+
+    def __init__(self,pin,n,bpp=3,timing=1):
+
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n*bpp)
+        self.timing = timing
+
+    def __len__(self):
+
+        return self.n
+
+    def __setitem__(self,i,v):
+
+        offset = i*self.bpp
+        for i in range(self.bpp):
+            self.buf[offset+self.ORDER[i]] = v[i]
+
+    def __getitem__(self,i):
+
+        offset = i*self.bpp
+        return tuple(self.buf[offset+self.ORDER[i]] for i in range(self.bpp))
+
+    def fill(self,v):
+
+        for i in range(self.n):
+            self[i] = v
+
+    def write(self):
+
+        # 800 kHz = 1.25 us per bit (400 kHz = 2.5), plus 50 us reset
+        us = len(self.buf)*8*(1.25 if self.timing else 2.5) + 50
+        counters['wire_us'] += int(us)
+        if wire_time:
+            time.sleep(us/1000000)
+
+        record(getattr(self.pin,'id',0) or 0,self.buf)
+
+#---------------------------------------------------------------
+# network
+#---------------------------------------------------------------
+
+STA_IF = 0
+AP_IF = 1
+
+class WLAN:
+
+    states = {}
+
+    def __init__(self,interface=STA_IF):
+
+        self.interface = interface
+
+    def active(self,state=None):
+
+        if state is None:
+            return WLAN.states.get(self.interface,(False,False))[0]
+        WLAN.states[self.interface] = (bool(state),False)
+
+    def connect(self,essid=None,password=None):
+
+        WLAN.states[self.interface] = (True,True)
+
+    def disconnect(self):
+
+        WLAN.states[self.interface] = (self.active(),False)
+
+    def isconnected(self):
+
+        return WLAN.states.get(self.interface,(False,False))[1]
+
+    def scan(self):
+
+        return []
+
+    def ifconfig(self):
+
+        return ('127.0.0.1','255.0.0.0','127.0.0.1','127.0.0.1')
+
+#---------------------------------------------------------------
+# install
+#---------------------------------------------------------------
+
+def install(wire=True,logfile=None,keep=True):
+
+    # wire = emulate the strip write time
+    # logfile = also log frames to this file
+    # keep = keep frames in npsim.frames
+
+    global wire_time, keep_frames, log
+
+    wire_time = wire
+    keep_frames = keep
+    if logfile:
+        log = open(logfile,'wb')
+        log.write(b'NPSIM1')
+
+    def module(name,**attrs):
+        m = types.ModuleType(name)
+        for key,value in attrs.items():
+            setattr(m,key,value)
+        sys.modules[name] = m
+
+    module('machine',Pin=Pin,RTC=RTC,Timer=Timer,lightsleep=lightsleep,idle=idle,reset=reset)
+    module('neopixel',NeoPixel=NeoPixel)
+    module('network',WLAN=WLAN,STA_IF=STA_IF,AP_IF=AP_IF)
+
+    import select
+    sys.modules['uselect'] = select
+
+    for f in (ticks_ms,ticks_us,ticks_add,ticks_diff,sleep_ms,sleep_us):
+        setattr(time,f.__name__,f)
+
+    reset_stats()
+
+def show(grid):
+
+    # print the grid (what was last written), '.' = off, '#' = on
+    # from the grid's own output buffer (a canvas has a strip per panel)
+
+    src = grid.buf if grid.out is None else grid.out
+    for y in range(grid.height-1,-1,-1):
+        row = ''
+        for x in range(grid.width):
+            n = grid.xymap[y*grid.width+x]*grid.colors
+            row += '#' if any(src[n:n+grid.colors]) else '.'
+        print(row)
+
+#---------------------------------------------------------------
+# measure the clock wave
+#---------------------------------------------------------------
+
+def main(waves=3,logfile=None):
+
+    install(True,logfile,False)
+
+    import clock3
+    clock = clock3.CLOCK(start=False)
+    timegrid = clock.tgrid('12:34')
+
+    for x in range(waves):
+        reset_stats()
+        clock.wave(timegrid,clock3.clock_fg,clock3.wave_water,clock3.wave_foam,clock3.wave_sand,x == 0)
+        s = stats()
+        print('WAVE {}: {:.1f} ms, {} frames, {:.1f} fps, wire {:.1f} ms ({:.0%}), busy {:.1f} ms ({:.0%}), slept {:.1f} ms'.format(
+            x+1,s['elapsed_ms'],s['frames'],s['fps'],s['wire_ms'],s['wire_duty'],s['busy_ms'],s['busy_duty'],s['slept_ms']))
+
+    show(clock.npg)
+
+    if log:
+        log.close()
+
+if __name__ == '__main__':
+    main(*[int(sys.argv[1])] if sys.argv[1:2] else [],*sys.argv[2:3])
@@ -9,8 +9,11 @@ print('LOAD: npxy.py')
 # Imports
 #---------------------------------------------------------------
 
+import sys
 import time
+import struct
 from os       import urandom
+from array    import array
 from machine  import Pin
 from neopixel import NeoPixel
 
@@ -64,52 +67,85 @@ bold_colors = [
 
           ]
 
-def get_color_name(name,maxvalue=32):
+class Palette:
 
-    color = (255,0,0)
-    name = name.lower()
-    for n,c in bold_colors:
-        if n == name:
-            color = c
-            break
-    # scale
-    scale = maxvalue/255
-    color = tuple([int(round(x*scale,0)) for x in color])
+    # The bold colors (or your own list of (name,color) tuples)
+    # scaled to maxvalue and gamma corrected ONCE, kept as bytes.
+    # A bytes color works anywhere a color tuple does.
 
-    # done
-    return color
+    # maxvalue = full scale (255) becomes this
+    # gamma = LED gamma correction, 1 = none (2.2 is typical)
 
-def next_color(maxvalue=32):
+    def __init__(self,maxvalue=32,gamma=1,colors=bold_colors):
 
-    colors = [x[1] for x in bold_colors]
-    maxplace = len(colors)-1
-    place = 0
-    scale = maxvalue/255
+        self.maxvalue = maxvalue
+        self.gamma = gamma
 
-    while 1:
+        # level lookup table (0-255 in, scaled and corrected out)
+        self.lut = bytes([int(round(maxvalue*(x/255)**gamma,0)) for x in range(256)])
 
-        color = colors[place]
-        yield tuple([int(round(x*scale,0)) for x in color])
+        self.names = [n for n,c in colors]
+        self.colors = [self.scale(c) for n,c in colors]
+        self.white = self.scale((255,255,255))
+        self.black = self.scale((0,0,0))
+        self.place = 0
 
-        place += 1
-        if place >= maxplace:
-            place = 0
-    
-def random_color(maxvalue=32,nowhite=False):
+    def scale(self,color):
+
+        return bytes([self.lut[x] for x in color])
+
+    def get(self,name):
+
+        # unknown names are red
+
+        name = name.lower()
+        if name in self.names:
+            return self.colors[self.names.index(name)]
+        return self.scale((255,0,0))
+
+    def next(self):
+
+        # next color in spectrum order
+
+        color = self.colors[self.place]
+        self.place = (self.place+1)%len(self.colors)
+        return color
+
+    def random(self,nowhite=False):
+
+        colors = self.colors
+        if not nowhite:
+            colors = colors+[self.white,self.black]
+
+        return colors[randint(len(colors)-1)]
+
+# one palette per maxvalue used by the functions below
+palettes = {}
+
+def get_palette(maxvalue=32):
+
+    palette = palettes.get(maxvalue)
+    if palette is None:
+        palette = palettes[maxvalue] = Palette(maxvalue)
+
+    return palette
+
+def get_color_name(name,maxvalue=32):
 
-    colors = [x[1] for x in bold_colors]
-    if not nowhite:
-        colors += [(255,255,255),(0,0,0)]
+    return get_palette(maxvalue).get(name)
 
-    # select
-    color = colors[randint(len(colors)-1)]
+def next_color(maxvalue=32):
+
+    palette = get_palette(maxvalue)
+    colors = palette.colors
 
-    # scale
-    scale = maxvalue/255
-    color = tuple([int(round(x*scale,0)) for x in color])
+    while 1:
+        for color in colors:
+            yield color
+    
+def random_color(maxvalue=32,nowhite=False):
 
-    # done
-    return color
+    return get_palette(maxvalue).random(nowhite)
 
 #---------------------------------------------------------------
 # Random Numbers
@@ -122,6 +158,137 @@ def randint(maximum=255):
 
     return int(ord(urandom(1))*min(256,maximum+1)/256)
 
+#---------------------------------------------------------------
+# Brightness
+#---------------------------------------------------------------
+
+# lut_copy(out,src,lut) = out[i] = lut[src[i]] for the whole buffer
+# one native pass where the port has viper (npxy_viper.py),
+# else bytearray.translate (CPython), else a Python loop
+
+try:
+    from npxy_viper import lut_copy
+except (ImportError,SyntaxError):
+    def lut_copy(out,src,lut):
+        if hasattr(src,'translate'):
+            out[:] = src.translate(lut)
+        else:
+            for i in range(len(out)):
+                out[i] = lut[src[i]]
+
+#---------------------------------------------------------------
+# Layer compositing
+#---------------------------------------------------------------
+
+# layer_copy(out,layer,alpha,c) = copy the opaque layer pixels to out
+# one native pass where the port has viper (npxy_viper.py),
+# else opaque runs are copied with one slice copy each
+
+try:
+    from npxy_viper import layer_copy
+except (ImportError,SyntaxError):
+    def layer_copy(out,layer,alpha,c):
+        pixels = len(alpha)
+        i = 0
+        while i < pixels:
+            if alpha[i]:
+                j = i + 1
+                while j < pixels and alpha[j]:
+                    j += 1
+                out[i*c:j*c] = layer[i*c:j*c]
+                i = j
+            else:
+                i += 1
+
+#---------------------------------------------------------------
+# Fonts
+#---------------------------------------------------------------
+
+def compile_font(font):
+
+    # font = list of equal-length strings, one per row, bottom row
+    #        first, 'X' = pixel on (the format of npxy_font.font)
+
+    # return = array of column bitmasks, one per font column,
+    #          bit 0 = bottom row ('B' up to 8 rows, else 'H')
+
+    height = len(font)
+    cols = array('B' if height <= 8 else 'H',[0]*len(font[0]))
+
+    for y in range(height):
+        bit = 1 << y
+        row = font[y]
+        for x in range(len(row)):
+            if row[x] == 'X':
+                cols[x] |= bit
+
+    return cols
+
+#---------------------------------------------------------------
+# Recorded animations
+#---------------------------------------------------------------
+
+def rle_encode(data,unit):
+
+    # data = bytes of whole units (a pixel or a palette index)
+    # return = (run count (1-255), unit bytes) pairs
+
+    out = bytearray()
+    i,end = 0,len(data)
+
+    while i < end:
+        value = data[i:i+unit]
+        j = i + unit
+        count = 1
+        while j < end and count < 255 and data[j:j+unit] == value:
+            j += unit
+            count += 1
+        out.append(count)
+        out.extend(value)
+        i = j
+
+    return bytes(out)
+
+#---------------------------------------------------------------
+# XY maps
+#---------------------------------------------------------------
+
+def serpentine_map(mode,width,height):
+
+    # return the xy-to-strip table for a serpentine mode (see NPXY)
+    # array('H') indexed from 0 by y*width+x, value = strip pixel
+
+    xymap = array('H',[0]*(width*height))
+
+    for y in range(height):
+        for x in range(width):
+
+            # rows, even row = LR, odd row = RL
+            if mode == 1:
+                if y%2==0:
+                    p = y*width + x
+                else:
+                    p = y*width + width - 1 - x
+
+            # columns, even col = BT, odd col = TB
+            elif mode == 2:
+                if x%2==0:
+                    p = x*height + y
+                else:
+                    p = x*height + height - 1 - y
+
+            # rows, always LR
+            elif mode == 3:
+                p = y*width + x
+
+            # columns, always BT
+            else:
+                p = x*height + y
+
+            xymap[y*width+x] = p
+
+    return xymap
+
 #---------------------------------------------------------------
 # XY grid for NeoPixels
 #---------------------------------------------------------------
@@ -202,11 +369,34 @@ class NPXY:
     # xoffset = default -1, the x offset of grid origin from lower left corner
     # yoffset = default -1, the y offset of grid origin from lower left corner
 
+    # mapfile = default None, load a custom wiring map (see load_map)
+    # instead of using one of the modes above.
+
+    # fontfile = default None, load this binary font file (see load_font)
+    # instead of the built-in font (npxy_font.py).
+    # limit_to = default None, only load these chars from fontfile.
+
+    # See NPXYCanvas (below) to use several strips as one grid.
+
     # Functions:
 
-    # write() = write grid buffer to pin (out to strip)
+    # write(force=False) = write grid buffer to pin (out to strip)
+    #   skipped if nothing changed since the last write (unless force)
+    #   returns True if written, False if skipped
+
+    # write_stats(reset=False) = return (frames sent, frames skipped)
+
+    # brightness(level=255) = dim the whole grid at write time (0-255)
+
+    # Layers (composited over the grid at write time, see class Layer):
 
-    # fill(*color) = fill grid with this color
+    # add_layer(name) = add a layer on top, return the Layer
+    # get_layer(name) = return the Layer with this name
+    # remove_layer(name) = remove the layer with this name
+    # show_layers(show=True) = turn all layers on or off
+    #   If you change self.buf directly, set self.dirty = True.
+
+    # fill(*color) = fill grid with this color (memoryview copies, fast)
 
     # off() = fill grid with zeros AND WRITE
 
@@ -216,7 +406,34 @@ class NPXY:
 
     # getp(x,y,*ignore) = get color of grid pixel (x,y)
 
+    # setpzf(x,y,color) = set grid pixel (x,y) indexed from 0, no checks (fast)
+
+    # load_map(mapfile) = load a custom xy-to-strip wiring map file
+    # save_map(mapfile) = save the current wiring map to a file
+
+    # Region functions (grid coordinates, clipped, strip runs done as bulk copies):
+
+    # hline(x,y,length,*color) = horizontal line from (x,y) to the right
+    # vline(x,y,length,*color) = vertical line from (x,y) up
+    # fill_rect(x,y,w,h,*color) = fill rectangle with lower left at (x,y)
+    # copy_row(src,dst) = copy row src to row dst
+    # copy_col(src,dst) = copy column src to column dst
+    # shift_x(n,*color) = shift grid n columns (+ right), fill empty with color
+    # shift_y(n,*color) = shift grid n rows (+ up), fill empty with color
+
+    # Strip functions (strip pixel numbers, from 0):
+
+    # setn(n,color) = set strip pixel n to color
+    # getn(n) = get color of strip pixel n
+    # fill_strip(start,count,color) = fill count strip pixels with color
+
     # load_font(fontfile,limit_to) = load the font file, limit to chars in string
+    # save_font(fontfile) = save the current font as a binary font file
+    # default_font() = use the built-in font
+
+    # set_col(x,y,mask,color,background=None,height=None)
+    #   set column x from row y up using bits of mask (bit 0 = row y)
+    #   indexed from 0, clipped, used by the text functions
 
     # fix_text(text,smash=True,strip=True,upper=True)
     #   fix/clean a string of text for printing (usually not called directly)
@@ -231,6 +448,8 @@ class NPXY:
     #   strip = text.strip()
     #   upper = text.upper() (required for default font)
     #   fixed = don't use self.fix_text (already done)
+
+    # text_cols(text,tail=0) = generate column masks for fixed text
     
     # center_text(text,color,smash=True,strip=True,upper=True)
     #   center text in grid as much as possible
@@ -239,14 +458,26 @@ class NPXY:
     #   strip = text.strip()
     #   upper = text.upper() (required for default font)
     
-    # scroll_text(text,color,background=None,  smash=True,strip=True,upper=True)
+    # scroll_text(text,color,background=None,  smash=True,strip=True,upper=True,interrupt=None,rate=10)
     #   scroll text in grid from right to left
     #   color is a color tuple for text
     #   background is a background color to fill (a color tuple)
+    #   rate = columns per second (held steady, late frames don't add up)
     #   smash = compress whitespace
     #   strip = text.strip()
     #   upper = text.upper() (required for default font)
 
+    # play(frames,interrupt=None) = run a frame generator (see animation below)
+
+    # record(frames,animfile,palette=True) = bake a frame generator to an animation file
+    # play_file(animfile,loops=1,interrupt=None) = play an animation file
+    # file_frames(animfile,loops=1,chunk=252) = frame generator for play_file
+    #   the *_frames functions are the frame generators for these:
+
+    # scroll_frames(text,color,background=None,smash=True,strip=True,upper=True,rate=10)
+    # test_strip_frames(maxvalue=32,loops=None,sleep=0.01)
+    # random_flash_frames(maxvalue=64,loops=None,fast=False)
+
     # test_strip(loops) = run red, green, and blue sequences up strip
     #                     do this "loop" times (set loop=None for forever)
 
@@ -259,7 +490,7 @@ class NPXY:
     # init
     #-----------------------------------------------------------
 
-    def __init__(self,pin,width,height,colors=3,timing=True,mode=1,xoffset=-1,yoffset=-1):
+    def __init__(self,pin,width,height,colors=3,timing=True,mode=1,xoffset=-1,yoffset=-1,mapfile=None,fontfile=None,limit_to=None):
 
         # save input
         self.width = width
@@ -268,227 +499,648 @@ class NPXY:
         self.xoffset = xoffset
         self.yoffset = yoffset
 
-        # set mode functions
+        # set mode
         if mode not in (1,2,3,4):
             mode = 1
-        if mode == 1:
-            self.setp   = self.setp_rows
-            self.getp   = self.getp_rows
-            self.setpzf = self.setp_rows_zf
-        elif mode == 2:
-            self.setp   = self.setp_cols
-            self.getp   = self.getp_cols
-            self.setpzf = self.setp_cols_zf
-        elif mode == 3:
-            self.setp   = self.setp_rows_z
-            self.getp   = self.getp_rows_z
-            self.setpzf = self.setp_rows_z_zf
-        elif mode == 4:
-            self.setp   = self.setp_cols_z
-            self.getp   = self.getp_cols_z
-            self.setpzf = self.setp_cols_z_zf
+        self.mode = mode
+
+        # font
+        if fontfile:
+            self.load_font(fontfile,limit_to)
+        else:
+            self.default_font()
+
+        # xy-to-strip lookup table
+        self.pixels = width*height
+        if mapfile:
+            self.load_map(mapfile)
+        else:
+            self.make_map(mode)
+
+        # set up pin and strip (makes self.np and self.buf)
+        self.make_strip(pin,timing)
+        self.mv = memoryview(self.buf)
+        self.order = getattr(self.np,'ORDER',(1,0,2,3))
+        self.packed = {}
+
+        # output buffer (only with layers or dimming)
+        self.lut = None
+        self.out = None
+        self.layers = []
+        self.layers_on = True
+
+        # dirty tracking (write() skips unchanged frames)
+        self.dirty = True
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+        self.off()
+
+    #-----------------------------------------------------------
+    # strip functions
+    #-----------------------------------------------------------
+
+    # These are the only functions that touch the NeoPixel driver.
+    # Override them to drive something else (see NPXYCanvas).
+
+    def make_strip(self,pin,timing):
 
         # set up pin
         self.pin = Pin(pin,Pin.OUT)
         self.pin.value(0)
 
         # set up neopixel class (acts as buffer)
-        self.pixels = width*height
-        if colors == 4:
+        if self.colors == 4:
             self.np = NeoPixel(self.pin,self.pixels,timing=timing,bpp=4)
         else:
             self.np = NeoPixel(self.pin,self.pixels,timing=timing)
-        self.off()
+
+        # framebuffer = the NeoPixel buffer (strip order, strip byte order)
+        # all drawing goes straight into this, write() sends it as-is
+        self.buf = self.np.buf
+
+    def attach(self,buf):
+
+        # send from buf (self.buf or self.out)
+
+        self.np.buf = buf
+
+    def send(self,force=False):
+
+        self.np.write()
 
     #-----------------------------------------------------------
     # non-XY functions
     #-----------------------------------------------------------
 
-    def write(self):
+    def write(self,force=False):
 
-        self.np.write()
+        # self.buf is the NeoPixel buffer, nothing to convert
+        # (unless there are layers or dimming, then self.out is)
+        # the strip write is slow and blocks interrupts,
+        # so skip it if nothing has changed since the last one
 
-    def off(self):
+        if not (self.dirty or force):
+            self.frames_skipped += 1
+            return False
 
-        self.clear(True)
+        if self.out is not None:
+            src = self.buf
+            if self.layers and self.layers_on:
+                self.compose()
+                src = self.out
+            if self.lut:
+                lut_copy(self.out,src,self.lut)
+            elif src is self.buf:
+                self.out[:] = src
 
-    def clear(self,send=False):
+        self.send(force)
+        self.dirty = False
+        self.frames_sent += 1
+        return True
 
-        color = (0,)*self.colors
+    def write_stats(self,reset=False):
 
-        for x in range(self.pixels):
-            self.np[x] = color
+        stats = (self.frames_sent,self.frames_skipped)
 
-        if send:
-            self.np.write()
+        if reset:
+            self.frames_sent = 0
+            self.frames_skipped = 0
 
-    def fill(self,color):
+        return stats
 
-        # this is faster than using self.np.fill
+    def brightness(self,level=255):
 
-        color = (color+(0,)*self.colors)[:self.colors]
+        # dim the whole grid at write time, 0-255 (255 = full)
+        # colors in the framebuffer are not changed,
+        # the strip is sent self.out = lut[self.buf]
+
+        if level >= 255:
+            self.lut = None
+        else:
+            level = max(0,level)
+            self.lut = bytes([(x*level+127)//255 for x in range(256)])
 
-        for x in range(self.pixels):
-            self.np[x] = color
+        self.set_out()
+
+    def set_out(self):
+
+        # use a separate output buffer only if needed
+
+        if self.lut or self.layers:
+            if self.out is None:
+                self.out = bytearray(len(self.buf))
+            self.attach(self.out)
+        else:
+            self.out = None
+            self.attach(self.buf)
+
+        self.dirty = True
 
     #-----------------------------------------------------------
-    # XY functions
+    # layers
     #-----------------------------------------------------------
 
-    # these are not used directly (use setp and getp)
+    # Layers sit on top of the framebuffer (self.buf), which is the
+    # bottom (background) layer. Each has its own buffer and a
+    # transparency mask, and they are composited into self.out in
+    # one pass at write time, bottom to top, in the order added.
 
-    def row_pixel(self,x,y):
-        
-        y += self.yoffset
-        x += self.xoffset
+    def add_layer(self,name):
 
-        if 0 <= y < self.height and 0 <= x < self.width:
+        layer = Layer(self,name)
+        self.layers.append(layer)
+        self.set_out()
 
-            # even row = LR
-            if y%2==0:
-                return y*self.width + x
+        return layer
 
-            # odd row = RL
-            else:
-                return y*self.width + self.width - 1 - x
+    def get_layer(self,name):
 
-        return None
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
 
-    def row_pixel_z(self,x,y):
-        
-        y += self.yoffset
-        x += self.xoffset
+    def remove_layer(self,name):
 
-        if 0 <= y < self.height and 0 <= x < self.width:
+        self.layers = [x for x in self.layers if x.name != name]
+        self.set_out()
 
-            return y*self.width + x
+    def show_layers(self,show=True):
 
-        return None
+        # turn all layers on or off (e.g. to show a message)
 
-    def col_pixel(self,x,y):
-        
-        y += self.yoffset
-        x += self.xoffset
+        self.layers_on = show
+        self.dirty = True
 
-        if 0 <= y < self.height and 0 <= x < self.width:
+    def compose(self):
 
-            # even col = BT
-            if x%2==0:
-                return x*self.height + y
+        # self.out = self.buf + visible layers (see layer_copy)
 
-            # odd col = TB
-            else:
-                return x*self.height + self.height - 1 - y
+        out = memoryview(self.out)
+        out[:] = self.mv
 
-        return None
+        for layer in self.layers:
+            if layer.visible:
+                layer_copy(out,layer.mv,layer.alpha,self.colors)
 
-    def col_pixel_z(self,x,y):
-        
-        y += self.yoffset
-        x += self.xoffset
+    def off(self):
+
+        self.clear(True)
+
+    def clear(self,send=False):
+
+        self.fill_strip(0,self.pixels,(0,))
 
-        if 0 <= y < self.height and 0 <= x < self.width:
+        if send:
+            self.write()
 
-            return x*self.height + y
+    def fill(self,*color):
 
-        return None
+        self.fill_strip(0,self.pixels,color)
 
-    def setp_rows(self,x,y,*color):
+    #-----------------------------------------------------------
+    # framebuffer functions
+    #-----------------------------------------------------------
 
-        pixel = self.row_pixel(x,y)
+    # These work on strip pixel numbers (not XY).
+    # Colors are packed into strip bytes (e.g. GRB) once and cached.
 
-        if pixel != None:
-            self.np[pixel] = (color+(0,)*self.colors)[:self.colors]
+    def pack(self,color):
 
-    def setp_rows_z(self,x,y,*color):
+        packed = self.packed.get(color)
 
-        pixel = self.row_pixel_z(x,y)
+        if packed is None:
+            packed = bytearray(self.colors)
+            for i in range(min(len(color),self.colors)):
+                packed[self.order[i]] = color[i]
+            packed = bytes(packed)
+            # don't let random colors eat the heap
+            if len(self.packed) < 64:
+                self.packed[color] = packed
 
-        if pixel != None:
-            self.np[pixel] = (color+(0,)*self.colors)[:self.colors]
+        return packed
 
-    def setp_cols(self,x,y,*color):
+    def setn(self,n,color):
 
-        pixel = self.col_pixel(x,y)
+        n *= self.colors
+        self.buf[n:n+self.colors] = self.pack(color)
+        self.dirty = True
 
-        if pixel != None:
-            self.np[pixel] = (color+(0,)*self.colors)[:self.colors]
-   
-    def setp_cols_z(self,x,y,*color):
+    def getn(self,n):
 
-        pixel = self.col_pixel_z(x,y)
+        n *= self.colors
+        return tuple([self.buf[n+self.order[i]] for i in range(self.colors)])
 
-        if pixel != None:
-            self.np[pixel] = (color+(0,)*self.colors)[:self.colors]
-   
-    def getp_rows(self,x,y,*rest):
+    def fill_strip(self,start,count,color):
 
-        pixel = self.row_pixel(x,y)
+        # fill count pixels from start, then keep doubling the filled
+        # part with memoryview copies (no per-pixel loop)
 
-        if pixel != None:
-            return self.np[pixel]
+        if count <= 0:
+            return
 
-    def getp_rows_z(self,x,y,*rest):
+        mv = self.mv
+        a = start*self.colors
+        b = a+count*self.colors
+        mv[a:a+self.colors] = self.pack(color)
+        done = self.colors
+        while a+done < b:
+            size = min(done,b-a-done)
+            mv[a+done:a+done+size] = mv[a:a+size]
+            done += size
+        self.dirty = True
 
-        pixel = self.row_pixel_z(x,y)
+    def move_strip(self,dst,src,count):
 
-        if pixel != None:
-            return self.np[pixel]
+        # copy count pixels from src to dst (may overlap)
 
-    def getp_cols(self,x,y,*rest):
+        if count > 0:
+            c = self.colors
+            self.mv[dst*c:(dst+count)*c] = self.mv[src*c:(src+count)*c]
+            self.dirty = True
 
-        pixel = self.col_pixel(x,y)
+    #-----------------------------------------------------------
+    # XY lookup table
+    #-----------------------------------------------------------
 
-        if pixel != None:
-            return self.np[pixel]
+    # The XY-to-strip math is done once in __init__ (or loaded from a
+    # map file) and stored in self.xymap, an array('H') indexed from 0
+    # by y*width+x. The setp, getp, and setpzf functions are then just
+    # a table lookup.
+
+    # A map file is plain text, one line per grid row, TOP row first
+    # (i.e. the way it looks on the wall), with the strip pixel number
+    # of each grid pixel from left to right, separated by spaces.
+    # Use save_map() to get a starting file for your wiring.
+
+    def make_map(self,mode=1):
+
+        self.xymap = serpentine_map(mode,self.width,self.height)
+
+    def load_map(self,mapfile):
+
+        xymap = array('H',[0]*self.pixels)
+        seen = bytearray(self.pixels)
+
+        rows = 0
+        with open(mapfile) as f:
+            for line in f:
+                line = line.split()
+                if not line:
+                    continue
+                if len(line) != self.width:
+                    raise ValueError('map row {} has {} pixels, not {}'.format(rows,len(line),self.width))
+                y = self.height - 1 - rows
+                if y < 0:
+                    raise ValueError('map has more than {} rows'.format(self.height))
+                for x,p in enumerate(line):
+                    p = int(p)
+                    if not 0 <= p < self.pixels or seen[p]:
+                        raise ValueError('bad map pixel {} at ({},{})'.format(p,x,y))
+                    seen[p] = 1
+                    xymap[y*self.width+x] = p
+                rows += 1
+        if rows != self.height:
+            raise ValueError('map has {} rows, not {}'.format(rows,self.height))
+
+        self.xymap = xymap
+
+        # custom wiring, no strip runs to take advantage of
+        self.mode = 0
+
+    def save_map(self,mapfile):
+
+        with open(mapfile,'w') as f:
+            for y in range(self.height-1,-1,-1):
+                row = self.xymap[y*self.width:(y+1)*self.width]
+                f.write(' '.join([str(p) for p in row])+'\n')
 
-    def getp_cols_z(self,x,y,*rest):
+    #-----------------------------------------------------------
+    # pixel functions
+    #-----------------------------------------------------------
 
-        pixel = self.col_pixel_z(x,y)
+    def setp(self,x,y,*color):
 
-        if pixel != None:
-            return self.np[pixel]
+        x += self.xoffset
+        y += self.yoffset
 
-    def setp_rows_zf(self,x,y,color):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            n = self.xymap[y*self.width+x]*self.colors
+            packed = self.pack(color)
+            # only dirty if it really changed
+            if self.buf[n:n+self.colors] != packed:
+                self.buf[n:n+self.colors] = packed
+                self.dirty = True
+
+    def getp(self,x,y,*rest):
+
+        x += self.xoffset
+        y += self.yoffset
+
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.getn(self.xymap[y*self.width+x])
+
+    def setpzf(self,x,y,color):
 
         # index from 0, no checks (fast)
 
-        if y%2==0:
-            self.np[y*self.width+x] = color
+        n = self.xymap[y*self.width+x]*self.colors
+        self.buf[n:n+self.colors] = self.pack(color)
+        self.dirty = True
+
+    #-----------------------------------------------------------
+    # region functions
+    #-----------------------------------------------------------
+
+    # These use grid coordinates (with offsets, like setp) and are
+    # clipped to the grid. When a run of pixels is also a run on the
+    # strip (rows in modes 1 and 3, columns in modes 2 and 4) it is
+    # done with memoryview slice copies instead of pixel-by-pixel.
+
+    def hline(self,x,y,length,*color):
+
+        x += self.xoffset
+        y += self.yoffset
+        if 0 <= y < self.height:
+            x2 = min(x+length,self.width)
+            x = max(x,0)
+            if x < x2:
+                self._hline(x,y,x2-x,color)
+
+    def vline(self,x,y,length,*color):
+
+        x += self.xoffset
+        y += self.yoffset
+        if 0 <= x < self.width:
+            y2 = min(y+length,self.height)
+            y = max(y,0)
+            if y < y2:
+                self._vline(x,y,y2-y,color)
+
+    def fill_rect(self,x,y,w,h,*color):
+
+        x += self.xoffset
+        y += self.yoffset
+        x2 = min(x+w,self.width)
+        y2 = min(y+h,self.height)
+        x = max(x,0)
+        y = max(y,0)
+        if x < x2 and y < y2:
+            if self.mode in (2,4):
+                for x in range(x,x2):
+                    self._vline(x,y,y2-y,color)
+            else:
+                for y in range(y,y2):
+                    self._hline(x,y,x2-x,color)
+
+    def copy_row(self,src,dst):
+
+        src += self.yoffset
+        dst += self.yoffset
+        if 0 <= src < self.height and 0 <= dst < self.height and src != dst:
+            self._copy_row(src,dst)
+
+    def copy_col(self,src,dst):
+
+        src += self.xoffset
+        dst += self.xoffset
+        if 0 <= src < self.width and 0 <= dst < self.width and src != dst:
+            self._copy_col(src,dst)
+
+    def shift_x(self,n,*color):
+
+        # shift the whole grid n columns (+ = right, - = left)
+        # fill the empty columns with color (default off)
+
+        w,h = self.width,self.height
+
+        if not n:
+            return
+        if abs(n) >= w:
+            self.fill_strip(0,self.pixels,color or (0,))
+            return
+
+        # modes 2 and 4: columns are blocks, one copy does it all
+        if self.mode == 4 or (self.mode == 2 and n%2 == 0):
+            if n > 0:
+                self.move_strip(n*h,0,(w-n)*h)
+            else:
+                self.move_strip(0,-n*h,(w+n)*h)
+
+        # modes 1 and 3: one copy per row
+        elif self.mode in (1,3):
+            for y in range(h):
+                start = y*w
+                if (n > 0) == (self.mode == 3 or y%2 == 0):
+                    self.move_strip(start+abs(n),start,w-abs(n))
+                else:
+                    self.move_strip(start,start+abs(n),w-abs(n))
 
+        # custom map or odd shift in mode 2
         else:
-            self.np[y*self.width+self.width-1-x] = color
+            if n > 0:
+                for x in range(w-1,n-1,-1):
+                    self._copy_col(x-n,x)
+            else:
+                for x in range(w+n):
+                    self._copy_col(x-n,x)
 
-    def setp_rows_z_zf(self,x,y,color):
+        # fill empty columns
+        color = color or (0,)
+        for x in (range(n) if n > 0 else range(w+n,w)):
+            self._vline(x,0,h,color)
 
-        # index from 0, no checks (fast)
+    def shift_y(self,n,*color):
 
-        self.np[y*self.width+x] = color
+        # shift the whole grid n rows (+ = up, - = down)
+        # fill the empty rows with color (default off)
 
-    def setp_cols_zf(self,x,y,color):
+        w,h = self.width,self.height
 
-        # index from 0, no checks (fast)
+        if not n:
+            return
+        if abs(n) >= h:
+            self.fill_strip(0,self.pixels,color or (0,))
+            return
 
-        if y%2==0:
-            self.np[x*self.height+y] = color
+        # modes 1 and 3: rows are blocks, one copy does it all
+        if self.mode == 3 or (self.mode == 1 and n%2 == 0):
+            if n > 0:
+                self.move_strip(n*w,0,(h-n)*w)
+            else:
+                self.move_strip(0,-n*w,(h+n)*w)
+
+        # modes 2 and 4: one copy per column
+        elif self.mode in (2,4):
+            for x in range(w):
+                start = x*h
+                if (n > 0) == (self.mode == 4 or x%2 == 0):
+                    self.move_strip(start+abs(n),start,h-abs(n))
+                else:
+                    self.move_strip(start,start+abs(n),h-abs(n))
 
+        # custom map or odd shift in mode 1
         else:
-            self.np[x*self.height+self.height-1-y] = color
+            if n > 0:
+                for y in range(h-1,n-1,-1):
+                    self._copy_row(y-n,y)
+            else:
+                for y in range(h+n):
+                    self._copy_row(y-n,y)
 
-    def setp_cols_z_zf(self,x,y,color):
+        # fill empty rows
+        color = color or (0,)
+        for y in (range(n) if n > 0 else range(h+n,h)):
+            self._hline(0,y,w,color)
 
-        # index from 0, no checks (fast)
+    # these index from 0, no checks
+
+    def _hline(self,x,y,length,color):
+
+        i = y*self.width+x
+        if self.mode in (1,3):
+            self.fill_strip(min(self.xymap[i],self.xymap[i+length-1]),length,color)
+        else:
+            packed,c = self.pack(color),self.colors
+            for i in range(i,i+length):
+                n = self.xymap[i]*c
+                self.buf[n:n+c] = packed
+            self.dirty = True
+
+    def _vline(self,x,y,length,color):
+
+        if self.mode in (2,4):
+            a = self.xymap[y*self.width+x]
+            b = self.xymap[(y+length-1)*self.width+x]
+            self.fill_strip(min(a,b),length,color)
+        else:
+            packed,c = self.pack(color),self.colors
+            for y in range(y,y+length):
+                n = self.xymap[y*self.width+x]*c
+                self.buf[n:n+c] = packed
+            self.dirty = True
 
-        self.np[x*self.height+y] = color
+    def _copy_row(self,src,dst):
+
+        w = self.width
+        if self.mode == 3 or (self.mode == 1 and (src-dst)%2 == 0):
+            self.move_strip(dst*w,src*w,w)
+        else:
+            xymap,c,mv = self.xymap,self.colors,self.mv
+            for x in range(w):
+                a = xymap[src*w+x]*c
+                b = xymap[dst*w+x]*c
+                mv[b:b+c] = mv[a:a+c]
+            self.dirty = True
+
+    def _copy_col(self,src,dst):
+
+        h = self.height
+        if self.mode == 4 or (self.mode == 2 and (src-dst)%2 == 0):
+            self.move_strip(dst*h,src*h,h)
+        else:
+            xymap,c,mv,w = self.xymap,self.colors,self.mv,self.width
+            for y in range(h):
+                a = xymap[y*w+src]*c
+                b = xymap[y*w+dst]*c
+                mv[b:b+c] = mv[a:a+c]
+            self.dirty = True
 
     #-----------------------------------------------------------
     # text display functions
     #-----------------------------------------------------------
 
-    # this is the default font
-    # this was generated with npxy_make_font.py
-    font  = ['  X  XXXX  XX XXX XXXXX    XXXX  XXXX XX X  XXXXXX   XX  X XX X    X XX  X XX   X   XX   X  X   XX   X  X  XXXX XXX XXXXXXXX XXX     X XXX  XXX  X    XXX  XXX         XXXXXX   X XX        X XXX       XXX    XX    XX X XX XX   XX  XXX     XX  X         X          X       X  ', '  X  XX  XX  XX  XX   X   X  XX  X X X  XX  XX   X   XX  XX  XX   X X X  XX  X  X  X  X X X XX XXX   X  X  X   X   X X  X   X   X    XX   XX   X X   X   XX   X        X    X  XX X X        X   X X X X X XX  XX   X  X XXX XXX X  X        X  X XX     XXXXX   XX   XXXXX       ', '  X  XX  XX   X  XX   X   X  XX  X X    XX X X   X   XX  XX  XX   X  XX X    X  X  X  XX   XX X X X X   X   X  X   X X   X      X    X    XX   X X   X   X    X     XXXX    X X      X      XX    XXXXX  X X X      X   XXXX XXXX    X    X  X  X X     X     X X  X X     X   X  ', '  XXXXXXX X   X  XXXX XXX X XXXXXX X    XXX  X   X   XX  XX  XXXX X  XXXX  XX   X  X  XX   XX   X  X    X    X X   X X    X   XX XXXXXXXXX XXXX   X   XXX  XXXX  XXX   X    X X      X   XXXXX XX  X X  XXX   X      XX     X   X    X   XXXXX  XX     X       XX  XX       X  X  ', '  X  XX  XX   X  XX   X   X   X  X X    XXX  X   X X XX XXX  XX  XX  XX  XX     X  X  XX   XX   X X X  X X    XX   X X     X    XX   XX    X       X X   XX   X     XXXX    X X X    X XXX  XX X X X X X X     X    X  X XXX XXXX    X    X  X  X XX    X     X X  X X     X    X ', '  X  XX  XX  XX  XX   X   X  XX  X X    XX X X   XX XXXX XX  XX  XX  XX  XX  X  X  X  XX   XX   XX   XX   X   XX   XXX X   XX   XX   XX    X   X    XX   XX   X X      X    XX   X    X     XX   XXXXXXX X XXX  XX XX  X XXX XXX X  X        X  X X X X  XXXXX   XX   XXXXX  X   X', '   XX XXX  XX XXX XXXXXXXX XX X  XXXX  XXX  XX   X   XX  X XX XXX  XX XXX  XX XXXXXX  XX   XX   XX   XX   XXXXX XXX  X  XXX  XXX     XXXXXX XXX XXXXX XXX  XXX X       XXXXXX    X          X XXX  X X  XXX XX    X  XX   XX XX   XX          XX  X X X   X              X    XXX ']
-    chars = {'height': 7, ' ': (' ', 2, 0), 'A': ('A', 4, 2), 'B': ('B', 4, 6), 'C': ('C', 4, 10), 'D': ('D', 4, 14), 'E': ('E', 4, 18), 'F': ('F', 4, 22), 'G': ('G', 4, 26), 'H': ('H', 4, 30), 'I': ('I', 3, 34), 'J': ('J', 4, 37), 'K': ('K', 4, 41), 'L': ('L', 4, 45), 'M': ('M', 5, 49), 'N': ('N', 4, 54), 'O': ('O', 4, 58), 'P': ('P', 4, 62), 'Q': ('Q', 4, 66), 'R': ('R', 4, 70), 'S': ('S', 4, 74), 'T': ('T', 5, 78), 'U': ('U', 4, 83), 'V': ('V', 5, 87), 'W': ('W', 5, 92), 'X': ('X', 5, 97), 'Y': ('Y', 5, 102), 'Z': ('Z', 4, 107), '0': ('0', 5, 111), '1': ('1', 3, 116), '2': ('2', 5, 119), '3': ('3', 5, 124), '4': ('4', 5, 129), '5': ('5', 5, 134), '6': ('6', 5, 139), '7': ('7', 5, 144), '8': ('8', 5, 149), '9': ('9', 5, 154), '`': ('`', 2, 159), '-': ('-', 3, 161), '=': ('=', 3, 164), '[': ('[', 3, 167), ']': (']', 3, 170), '\\': ('\\', 3, 173), ';': (';', 1, 176), "'": ("'", 1, 177), ',': (',', 1, 178), '.': ('.', 1, 179), '/': ('/', 3, 180), '~': ('~', 5, 183), '!': ('!', 1, 188), '@': ('@', 5, 189), '#': ('#', 5, 194), '$': ('$', 5, 199), '%': ('%', 5, 204), '^': ('^', 3, 209), '&': ('&', 5, 212), '*': ('*', 7, 217), '(': ('(', 3, 224), ')': (')', 3, 227), '_': ('_', 3, 230), '+': ('+', 3, 233), '{': ('{', 3, 236), '}': ('}', 3, 239), '|': ('|', 1, 242), ':': (':', 1, 243), '"': ('"', 3, 244), '<': ('<', 11, 247), '>': ('>', 11, 258), '?': ('?', 5, 269)} #
+    # The font is loaded in __init__ (see load_font and default_font).
+    # chars = char:(char,width,column index), plus 'height'
+    # fontcols[cindex+x] = bitmask for column x of a char (bit 0 = bottom)
+    chars = None
+    fontcols = None
+
+    # Binary font file format (little-endian):
+    #
+    #   header = 'NPF', version (B), height (B), bytes per column (B), glyphs (H)
+    #   glyph table = glyphs x (char code (H), width (H), column index (H))
+    #   columns = packed column bitmasks, 1 or 2 bytes each, bit 0 = bottom row
+    #
+    # Use save_font() to make one from the current font.
+
+    def default_font(self):
+
+        # compile the built-in font once (shared by all instances)
+
+        if NPXY.fontcols is None:
+            import npxy_font
+            NPXY.chars = npxy_font.chars
+            NPXY.fontcols = compile_font(npxy_font.font)
+            del npxy_font
+            del sys.modules['npxy_font']
+
+        self.chars = NPXY.chars
+        self.fontcols = NPXY.fontcols
+
+    def load_font(self,fontfile,limit_to=None):
+
+        # load a binary font file
+        # limit_to = string of chars to load (others are skipped)
+        # space is always loaded (fix_text uses it for unknown chars)
+
+        if limit_to is not None:
+            limit_to = set(limit_to+' ')
+
+        with open(fontfile,'rb') as f:
+
+            magic,version,height,colbytes,count = struct.unpack('<3sBBBH',f.read(8))
+            if magic != b'NPF' or version != 1 or colbytes not in (1,2):
+                raise ValueError('not an NPF font file: {}'.format(fontfile))
+            table = f.read(count*6)
+            data_start = 8 + count*6
+
+            # select glyphs
+            glyphs = []
+            total = 0
+            for i in range(count):
+                code,width,index = struct.unpack_from('<HHH',table,i*6)
+                c = chr(code)
+                if limit_to is None or c in limit_to:
+                    glyphs.append((index,c,width))
+                    total += width
+            del table
+
+            # read only the selected columns, in file order
+            glyphs.sort()
+            fontcols = array('B' if colbytes == 1 else 'H',[0]*total)
+            mv = memoryview(fontcols)
+            chars = {'height':height}
+            place = 0
+            for index,c,width in glyphs:
+                f.seek(data_start+index*colbytes)
+                f.readinto(mv[place:place+width])
+                chars[c] = (c,width,place)
+                place += width
+
+        self.chars = chars
+        self.fontcols = fontcols
+
+    def save_font(self,fontfile):
+
+        # save the current font as a binary font file
+
+        glyphs = [x for x in self.chars.values() if type(x) == tuple]
+        colbytes = 1 if self.chars['height'] <= 8 else 2
+
+        with open(fontfile,'wb') as f:
+            f.write(struct.pack('<3sBBBH',b'NPF',1,self.chars['height'],colbytes,len(glyphs)))
+            place = 0
+            for c,width,index in glyphs:
+                f.write(struct.pack('<HHH',ord(c),width,place))
+                place += width
+            for c,width,index in glyphs:
+                cols = self.fontcols[index:index+width]
+                if colbytes == 1:
+                    f.write(bytes(cols))
+                else:
+                    for col in cols:
+                        f.write(struct.pack('<H',col))
 
     def fix_text(self,text,smash=True,strip=True,upper=True):
 
@@ -516,22 +1168,52 @@ class NPXY:
             text = self.fix_text(text,smash,strip,upper)
 
         if text:
-            xindex = 0
-            char_height = self.chars['height']
+            fontcols = self.fontcols
+            x = xshift
             for c in text:
                 c2,cwidth,cindex = self.chars[c]
-                for x in range(cwidth):
-                    cX = cindex + x
-                    tX = xindex + xshift - self.xoffset
-                    for cY in range(char_height-1,-1,-1):
-                        if self.font[cY][cX] == 'X':
-                            tY = cY + yshift - self.yoffset
-                            self.setp(tX,tY,*color)
-                    xindex += 1
-                xindex += 1
-                if xindex + xshift - self.xoffset >= self.width:
+                for cX in range(cindex,cindex+cwidth):
+                    self.set_col(x,yshift,fontcols[cX],color)
+                    x += 1
+                x += 1
+                if x >= self.width:
                     break
 
+    def set_col(self,x,y,mask,color,background=None,height=None):
+
+        # column x (from 0), bit 0 of mask at row y (from 0)
+        # set pixels for 1 bits to color
+        # set pixels for 0 bits to background (if given) for height rows
+        # clipped to the grid
+
+        if not 0 <= x < self.width:
+            return
+
+        if height is None:
+            height = self.chars['height']
+        if y < 0:
+            mask >>= -y
+            height += y
+            y = 0
+        top = min(y+height,self.height)
+
+        packed = self.pack(color)
+        bg = None if background is None else self.pack(background)
+        c,buf,xymap,w = self.colors,self.buf,self.xymap,self.width
+
+        for y in range(y,top):
+            if mask & 1:
+                n = xymap[y*w+x]*c
+                buf[n:n+c] = packed
+            elif bg:
+                n = xymap[y*w+x]*c
+                buf[n:n+c] = bg
+            elif not mask:
+                break
+            mask >>= 1
+
+        self.dirty = True
+
     def center_text(self,text,color,smash=True,strip=True,upper=True,nofix=False):
 
         # DO NOT use offsets (applied in place_text() and setp())
@@ -554,7 +1236,29 @@ class NPXY:
 
             self.place_text(text,color,xshift,yshift,fixed=True)
 
-    def scroll_text(self,text,color,background=None,smash=True,strip=True,upper=True,interrupt=None):
+    def text_cols(self,text,tail=0):
+
+        # generate column masks for (fixed) text, one at a time
+        # one blank column after each char, then tail blank columns
+        # (constant memory, no matter how long the text is)
+
+        fontcols = self.fontcols
+        for c in text:
+            c2,cwidth,cindex = self.chars[c]
+            for cX in range(cindex,cindex+cwidth):
+                yield fontcols[cX]
+            yield 0
+        for x in range(tail):
+            yield 0
+
+    def scroll_text(self,text,color,background=None,smash=True,strip=True,upper=True,interrupt=None,rate=10):
+
+        self.play(self.scroll_frames(text,color,background,smash,strip,upper,rate),interrupt)
+
+    def scroll_frames(self,text,color,background=None,smash=True,strip=True,upper=True,rate=10):
+
+        # frame generator for scroll_text (see play)
+        # rate = columns per second
 
         text = self.fix_text(text,smash,strip,upper)
 
@@ -566,28 +1270,6 @@ class NPXY:
             else:
                 yshift = int( (self.height - self.chars['height']) // 2 )
 
-            # make block text from font
-            lines = []
-            char_height = self.chars['height']
-            for y in range(char_height-1,-1,-1):
-                lines.append(' '*self.width)
-            for c in text:
-                c2,cwidth,cindex = self.chars[c]
-                for y in range(char_height-1,-1,-1):
-                    lines[y] += self.font[y][cindex:cindex+cwidth]
-                for y in range(char_height-1,-1,-1):
-                    lines[y] += ' '           
-            for y in range(char_height-1,-1,-1):
-                lines[y] += ' '*self.width
-
-            # it's too slow to do a background fill each time
-            # do an intial fill (clear)
-            # place text using text color
-            # write to pixels
-            # place text using background color (erase)
-
-            # this needs more work
-
             # initial background color
             if not background:
                 background = (0,)*self.colors
@@ -595,39 +1277,32 @@ class NPXY:
             else:
                 self.fill(*background)
 
-            # iter through font lines, send self.width cols
-            lastloop = 0
-            for x1 in range(0,len(lines[0])-self.width,1):
+            # the framebuffer is the scroll window:
+            # shift it left one column, draw only the new right column
+
+            # frame n is due at start + n/rate (no drift),
+            # if more than a frame late, restart the count from now
+            period = 1000/rate
+            start = time.ticks_ms()
+            frame = 0
+
+            for mask in self.text_cols(text,self.width-1):
 
                 # wait
-                while time.ticks_ms()/1000 - lastloop < 0.1:
-                    time.sleep(0.001)
-                lastloop = time.ticks_ms()/1000
-
-                # set text
-                for x2 in range(self.width):
-                    for y in range(char_height-1,-1,-1):
-                        if lines[y][x1+x2] == 'X':
-                            ty = y + yshift
-                            tx = x2
-                            self.setpzf(tx,ty,color)
+                frame += 1
+                due = time.ticks_add(start,int(frame*period))
+                yield due
+                if time.ticks_diff(time.ticks_ms(),due) > period:
+                    start = time.ticks_ms()
+                    frame = 0
+
+                # new column
+                self.shift_x(-1,*background)
+                self.set_col(self.width-1,yshift,mask,color)
 
                 # write
                 self.write()
 
-                # erase
-                for x2 in range(self.width):
-                    for y in range(char_height-1,-1,-1):
-                        if lines[y][x1+x2] == 'X':
-                            ty = y + yshift
-                            tx = x2
-                            self.setpzf(tx,ty,background)
-
-                # interrupt
-                if interrupt and interrupt['flag']:
-                    self.off()
-                    break
-
     def flash_chars(self,text,color,ontime=0.25,offtime=0.25,smash=True,strip=True,upper=True,interrupt=None):
 
         text = self.fix_text(text,smash,strip,upper)
@@ -662,42 +1337,42 @@ class NPXY:
 
     def test_strip(self,maxvalue=32,loops=None,sleep=0.01,interrupt=None):
 
+        try:
+            self.play(self.test_strip_frames(maxvalue,loops,sleep),interrupt)
+        except KeyboardInterrupt:
+            pass
+
+    def test_strip_frames(self,maxvalue=32,loops=None,sleep=0.01):
+
         self.off()
 
         try:
 
             loopcount = 0
+            off = (0,)
             for color in next_color(maxvalue):
-                off = (0,0,0)
-                if self.colors == 4:
-                    color += (0,)
-                    off = (0,0,0,0)
                 self.clear()
                 for x in range(self.pixels):
-                    if x == 0:
-                        self.np[self.pixels-1] = off
-                    else:
-                        self.np[x-1] = off
-                    self.np[x] = color
+                    self.setn(x-1 if x else self.pixels-1,off)
+                    self.setn(x,color)
                     self.write()
-                    time.sleep(sleep)
+                    yield time.ticks_add(time.ticks_ms(),int(sleep*1000))
                 loopcount += 1
                 if loops and loopcount >= loops:
                     break
 
-                # interrupt
-                if interrupt and interrupt['flag']:
-                    self.off()
-                    break
-
-        except KeyboardInterrupt:
-            pass
-
         finally:
             self.off()
 
     def random_flash(self,maxvalue=64,loops=None,fast=False,interrupt=None):
 
+        try:
+            self.play(self.random_flash_frames(maxvalue,loops,fast),interrupt)
+        except KeyboardInterrupt:
+            pass
+
+    def random_flash_frames(self,maxvalue=64,loops=None,fast=False):
+
         self.off()
 
         try:
@@ -708,40 +1383,521 @@ class NPXY:
                 pixel = randint(self.pixels-1)
 
                 color = random_color(maxvalue)
-                off   = (0,0,0)
-                if self.colors == 4:
-                    color += (0,)
-                    off = (0,0,0,0)
+                off   = (0,)
 
-                self.np[pixel] = color
-                self.np.write()
+                self.setn(pixel,color)
+                self.write()
 
                 if not fast:
-                    time.sleep(randint(25)/100)
+                    yield time.ticks_add(time.ticks_ms(),randint(25)*10)
                 else:
-                    time.sleep(0.05)
+                    yield time.ticks_add(time.ticks_ms(),50)
 
-                self.np[pixel] = off
-                self.np.write()
+                self.setn(pixel,off)
+                self.write()
 
                 if not fast:
-                    time.sleep(randint(50)/100)
+                    yield time.ticks_add(time.ticks_ms(),randint(50)*10)
 
                 loopcount += 1
                 if loops and loopcount >= loops:
                     break
 
-                # interrupt
+        finally:
+            self.off()
+
+    #-----------------------------------------------------------
+    # animation
+    #-----------------------------------------------------------
+
+    # Animations are frame generators: they draw and write a frame,
+    # then yield the time.ticks_ms() time the next one is due.
+    # play() runs one here (blocking), npsched.Scheduler runs them
+    # as asyncio tasks alongside other work. Closing the generator
+    # cancels it (its finally blocks run).
+
+    def play(self,frames,interrupt=None):
+
+        # interrupt = dict, stop (and turn off) when interrupt['flag']
+
+        try:
+            for due in frames:
                 if interrupt and interrupt['flag']:
                     self.off()
                     break
-        
-        except KeyboardInterrupt:
-            pass
-
+                wait = time.ticks_diff(due,time.ticks_ms())
+                if wait > 0:
+                    time.sleep_ms(wait)
         finally:
-            self.off()
+            frames.close()
+
+    #-----------------------------------------------------------
+    # recorded animations
+    #-----------------------------------------------------------
+
+    # An effect can be run once (here or on a host with npsim.py),
+    # saved with record(), then played back from flash with almost
+    # no drawing work. The grid size and colors must match.
+
+    # Binary animation file format (little-endian):
+    #
+    #   header = 'NPA', version (B), width (H), height (H), bytes per pixel (B),
+    #            palette colors (H, 0 = no palette), frames (H), palette offset (I)
+    #   frames = frames x (type (B), show time ms (H), data bytes (I), data)
+    #   palette = palette colors x bytes per pixel (strip byte order)
+    #
+    # A unit is a pixel (strip byte order), or a 1 byte palette index.
+    # Frame types (the smallest is saved):
+    #
+    #   0 = raw, all units
+    #   1 = run-length, (count (B), unit) pairs
+    #   2 = XOR with the previous frame, then run-length (0 = unchanged)
+    #
+    # Frames are the grid with layers, before dimming (brightness
+    # still works on playback). The first frame is never type 2.
+
+    def record(self,frames,animfile,palette=True):
+
+        # run a frame generator (in real time, like play) and save its frames
+        # palette = store palette indexes (up to 256 colors)
+        # return = frames saved
+
+        c = self.colors
+        unit = 1 if palette else c
+        colors = {}
+        saved = [0,None] # count, previous frame
+
+        def save(data,show):
+            prev = saved[1]
+            kind,best = 0,data
+            for k,encoded in ((1,rle_encode(data,unit)),
+                              (2,prev and rle_encode(bytes([a^b for a,b in zip(data,prev)]),unit))):
+                if encoded and len(encoded) < len(best):
+                    kind,best = k,encoded
+            f.write(struct.pack('<BHI',kind,min(show,65535),len(best)))
+            f.write(best)
+            saved[0] += 1
+            saved[1] = data
+
+        self.clear()
+
+        with open(animfile,'wb') as f:
+
+            f.write(bytes(17))
+
+            # a frame is shown until the next different one
+            # (time spent here making frames is not counted)
+            last,mark = None,time.ticks_ms()
+            try:
+                for due in frames:
+                    last,mark = self.record_next(last,mark,save,colors,palette)
+                    wait = time.ticks_diff(due,time.ticks_ms())
+                    if wait > 0:
+                        time.sleep_ms(wait)
+            finally:
+                frames.close()
+
+            # the end result
+            last,mark = self.record_next(last,mark,save,colors,palette)
+            save(last,0)
+
+            # palette at the end (its size is known now)
+            offset = f.tell()
+            for color in sorted(colors,key=colors.get):
+                f.write(color)
+            f.seek(0)
+            f.write(struct.pack('<3sBHHBHHI',b'NPA',1,self.width,self.height,c,len(colors),saved[0],offset))
+
+        return saved[0]
+
+    def record_next(self,last,mark,save,colors,palette):
+
+        # save last if the frame has changed (see record)
+        # return = (current frame, time it started)
+
+        start = time.ticks_ms()
+        frame = self.record_frame(colors,palette)
+        now = time.ticks_ms()
+
+        if frame == last:
+            return last,time.ticks_add(mark,time.ticks_diff(now,start))
+        if last is not None:
+            save(last,max(0,time.ticks_diff(start,mark)))
+        return frame,now
+
+    def record_frame(self,colors,palette):
+
+        # the current frame as file units (see record)
+
+        if self.layers and self.layers_on:
+            self.compose()
+            src = self.out
+        else:
+            src = self.buf
+
+        if not palette:
+            return bytes(src)
+
+        c = self.colors
+        frame = bytearray(self.pixels)
+        for p in range(self.pixels):
+            color = bytes(src[p*c:p*c+c])
+            index = colors.get(color)
+            if index is None:
+                index = len(colors)
+                if index > 255:
+                    raise ValueError('more than 256 colors, use palette=False')
+                colors[color] = index
+            frame[p] = index
+
+        return bytes(frame)
+
+    def play_file(self,animfile,loops=1,interrupt=None):
+
+        self.play(self.file_frames(animfile,loops),interrupt)
+
+    def file_frames(self,animfile,loops=1,chunk=252):
+
+        # frame generator for an animation file (see record)
+        # loops = times to play, None = forever
+        # chunk = read buffer size (frames are streamed through it)
+
+        with open(animfile,'rb') as f:
+
+            magic,version,width,height,c,colors,count,offset = struct.unpack('<3sBHHBHHI',f.read(17))
+            if magic != b'NPA' or version != 1 or width*height != self.pixels or c != self.colors:
+                raise ValueError('not an NPA animation for this grid: {}'.format(animfile))
+
+            # palette (and the index frame, for XOR frames)
+            pal,idx = None,None
+            if colors:
+                f.seek(offset)
+                pal = memoryview(f.read(colors*c))
+                idx = bytearray(self.pixels)
+
+            # reusable buffers, chunk holds whole (count,unit) pairs
+            unit = 1 if pal else c
+            chunk = memoryview(bytearray(max(1,chunk//(unit+1))*(unit+1)))
+            head = bytearray(7)
+
+            # the file is the whole picture
+            layers_on = self.layers_on
+            self.layers_on = False
+
+            try:
+                loop = 0
+                due = time.ticks_ms()
+                while loops is None or loop < loops:
+                    loop += 1
+                    f.seek(17)
+                    for frame in range(count):
+
+                        f.readinto(head)
+                        kind,show,size = struct.unpack('<BHI',head)
+
+                        if kind == 0 and not pal:
+                            f.readinto(self.mv[:size])
+                        else:
+                            p = 0
+                            while size > 0:
+                                n = f.readinto(chunk[:min(size,len(chunk))])
+                                if not n:
+                                    break
+                                size -= n
+                                p = self.decode_units(kind,chunk[:n],p,pal,idx)
+
+                        self.dirty = True
+                        self.write()
+
+                        # frames can't be dropped (XOR frames need the last),
+                        # so if late, start the clock again from now
+                        due = time.ticks_add(due,show)
+                        if time.ticks_diff(time.ticks_ms(),due) > 0:
+                            due = time.ticks_ms()
+                        yield due
+
+            finally:
+                self.layers_on = layers_on
+                self.dirty = True
+
+    def decode_units(self,kind,data,p,pal,idx):
+
+        # decode data (whole units, or whole pairs) into the
+        # framebuffer from pixel p, return the next pixel
+
+        c,mv = self.colors,self.mv
+
+        # raw palette indexes
+        if kind == 0:
+            for v in data:
+                idx[p] = v
+                mv[p*c:p*c+c] = pal[v*c:v*c+c]
+                p += 1
+            return p
+
+        step = 2 if pal else c+1
+        for i in range(0,len(data),step):
+            count = data[i]
+            a = p*c
+
+            # run of one color (fill by doubling)
+            if kind == 1:
+                if pal:
+                    v = data[i+1]
+                    for x in range(p,p+count):
+                        idx[x] = v
+                    mv[a:a+c] = pal[v*c:v*c+c]
+                else:
+                    mv[a:a+c] = data[i+1:i+1+c]
+                done,b = c,a+count*c
+                while a+done < b:
+                    size = min(done,b-a-done)
+                    mv[a+done:a+done+size] = mv[a:a+size]
+                    done += size
+
+            # XOR run (0 = unchanged)
+            elif pal:
+                v = data[i+1]
+                if v:
+                    for x in range(p,p+count):
+                        idx[x] ^= v
+                        v2 = idx[x]*c
+                        mv[x*c:x*c+c] = pal[v2:v2+c]
+            else:
+                value = data[i+1:i+1+c]
+                if any(value):
+                    for x in range(a,a+count*c,c):
+                        for j in range(c):
+                            mv[x+j] ^= value[j]
+
+            p += count
+
+        return p
 
     #-----------------------------------------------------------
     # end of NPXY class
     #-----------------------------------------------------------
+
+#---------------------------------------------------------------
+# Layers
+#---------------------------------------------------------------
+
+class Layer:
+
+    # A layer over an NPXY grid (use NPXY.add_layer, not this).
+
+    # It has its own framebuffer (strip order, like the grid) and one
+    # alpha byte per pixel, 0 = transparent (grid or lower layer shows).
+    # Drawing marks the grid dirty, so grid.write() sends the change.
+
+    # setp(x,y,*color) = set pixel opaque (grid coordinates, checked)
+    # clearp(x,y) = set pixel transparent (grid coordinates, checked)
+    # setpzf(x,y,color) = setp indexed from 0, no checks (fast)
+    # clearpzf(x,y) = clearp indexed from 0, no checks (fast)
+    # clear() = whole layer transparent
+    # show(visible=True) = show or hide the layer
+
+    def __init__(self,grid,name):
+
+        self.grid = grid
+        self.name = name
+        self.buf = bytearray(len(grid.buf))
+        self.mv = memoryview(self.buf)
+        self.alpha = bytearray(grid.pixels)
+        self.visible = True
+
+    def show(self,visible=True):
+
+        self.visible = visible
+        self.grid.dirty = True
+
+    def clear(self):
+
+        self.alpha[:] = bytes(len(self.alpha))
+        self.grid.dirty = True
+
+    def setp(self,x,y,*color):
+
+        grid = self.grid
+        x += grid.xoffset
+        y += grid.yoffset
+
+        if 0 <= x < grid.width and 0 <= y < grid.height:
+            p = grid.xymap[y*grid.width+x]
+            n = p*grid.colors
+            packed = grid.pack(color)
+            # only dirty if it really changed
+            if not self.alpha[p] or self.buf[n:n+grid.colors] != packed:
+                self.buf[n:n+grid.colors] = packed
+                self.alpha[p] = 1
+                grid.dirty = True
+
+    def clearp(self,x,y):
+
+        grid = self.grid
+        x += grid.xoffset
+        y += grid.yoffset
+
+        if 0 <= x < grid.width and 0 <= y < grid.height:
+            p = grid.xymap[y*grid.width+x]
+            if self.alpha[p]:
+                self.alpha[p] = 0
+                grid.dirty = True
+
+    def setpzf(self,x,y,color):
+
+        grid = self.grid
+        p = grid.xymap[y*grid.width+x]
+        n = p*grid.colors
+        self.buf[n:n+grid.colors] = grid.pack(color)
+        self.alpha[p] = 1
+        grid.dirty = True
+
+    def clearpzf(self,x,y):
+
+        grid = self.grid
+        self.alpha[grid.xymap[y*grid.width+x]] = 0
+        grid.dirty = True
+
+#---------------------------------------------------------------
+# Canvas of several strips
+#---------------------------------------------------------------
+
+class NPXYCanvas(NPXY):
+
+    # One XY grid made of several panels, each its own strip on its
+    # own pin, with its own serpentine mode. Everything NPXY does works
+    # the same, on the whole canvas.
+
+    # The panels share one framebuffer, one after the other in the
+    # order given. Each NeoPixel driver gets a memoryview of its part,
+    # and write() sends each strip back to back, skipping any strip
+    # whose part has not changed since it was last sent.
+
+    # Init Variables:
+
+    # panels = list of (pin,width,height,mode,x,y) tuples, one per strip
+    #   width,height,mode = the panel, like NPXY (modes 1-4)
+    #   x,y = panel lower left corner on the canvas, from 0
+    #   Canvas pixels not on any panel are drawn to a spare pixel
+    #   that is never sent.
+
+    # width,height = the canvas size in pixels
+
+    # colors,timing,xoffset,yoffset,fontfile,limit_to = same as NPXY
+
+    # Example: two 32x8 panels (mode 4) on pins 4 and 5 stacked into 32x16
+    # NPXYCanvas([(4,32,8,4,0,0),(5,32,8,4,0,8)],32,16)
+
+    def __init__(self,panels,width,height,colors=3,timing=True,xoffset=-1,yoffset=-1,fontfile=None,limit_to=None):
+
+        self.panels = panels
+
+        NPXY.__init__(self,None,width,height,colors,timing,1,xoffset,yoffset,None,fontfile,limit_to)
+
+    def make_map(self,mode=1):
+
+        # each panel's strip follows the last in the framebuffer
+
+        w,h = self.width,self.height
+        total = sum([pw*ph for pin,pw,ph,pmode,px,py in self.panels])
+        xymap = array('H',[total]*(w*h))
+
+        covered = 0
+        start = 0
+        for pin,pw,ph,pmode,px,py in self.panels:
+            pmap = serpentine_map(pmode,pw,ph)
+            for y in range(ph):
+                for x in range(pw):
+                    if 0 <= px+x < w and 0 <= py+y < h:
+                        if xymap[(py+y)*w+px+x] == total:
+                            covered += 1
+                        xymap[(py+y)*w+px+x] = start + pmap[y*pw+x]
+            start += pw*ph
+
+        # spare pixel for any gaps (drawn to, but always read as off)
+        self.spare = total if covered < w*h else None
+        self.pixels = total + (1 if covered < w*h else 0)
+        self.xymap = xymap
+
+        # no single strip layout, region functions go pixel by pixel
+        self.mode = 0
+
+    # Reads skip the spare pixel, so a gap reads as off, not as
+    # whatever was last drawn into any gap (getp, and the row and
+    # column copies under copy_row/col and shift_x/y).
+
+    def getp(self,x,y,*rest):
+
+        x += self.xoffset
+        y += self.yoffset
+
+        if 0 <= x < self.width and 0 <= y < self.height:
+            n = self.xymap[y*self.width+x]
+            if n == self.spare:
+                return (0,)*self.colors
+            return self.getn(n)
+
+    def _copy_row(self,src,dst):
+
+        w = self.width
+        self.copy_pixels(src*w,dst*w,1,w)
+
+    def _copy_col(self,src,dst):
+
+        w = self.width
+        self.copy_pixels(src,dst,w,self.height)
+
+    def copy_pixels(self,src,dst,step,count):
+
+        # copy count grid pixels (xymap indexes, step apart), gaps are off
+
+        xymap,c,mv,spare = self.xymap,self.colors,self.mv,self.spare
+        off = bytes(c)
+        for i in range(count):
+            a = xymap[src+i*step]
+            b = xymap[dst+i*step]*c
+            if a == spare:
+                mv[b:b+c] = off
+            else:
+                mv[b:b+c] = mv[a*c:a*c+c]
+        self.dirty = True
+
+    def make_strip(self,pin,timing):
+
+        self.buf = bytearray(self.pixels*self.colors)
+        self.sent = bytearray(len(self.buf))
+
+        self.strips = []
+        start = 0
+        for pin,pw,ph,pmode,px,py in self.panels:
+            pin = Pin(pin,Pin.OUT)
+            pin.value(0)
+            if self.colors == 4:
+                np = NeoPixel(pin,pw*ph,timing=timing,bpp=4)
+            else:
+                np = NeoPixel(pin,pw*ph,timing=timing)
+            self.strips.append((np,start*self.colors,(start+pw*ph)*self.colors))
+            start += pw*ph
+
+        # byte order from the first driver
+        self.np = self.strips[0][0]
+        self.attach(self.buf)
+
+    def attach(self,buf):
+
+        self.active = memoryview(buf)
+        for np,a,b in self.strips:
+            np.buf = self.active[a:b]
+
+        # send everything next time
+        self.sent_ok = False
+
+    def send(self,force=False):
+
+        active,sent = self.active,self.sent
+        for np,a,b in self.strips:
+            if force or not self.sent_ok or active[a:b] != sent[a:b]:
+                np.write()
+                sent[a:b] = active[a:b]
+        self.sent_ok = True
@@ -0,0 +1,15 @@
+# npxy_font.py
+# Copyright (c) 2017 Clayton Darwin
+# claytondarwin.com claytondarwin@gmail.com
+
+# This is the default NPXY font.
+# It is only imported if no font file is given (see NPXY.load_font).
+# NPXY compiles it to column bitmasks and then drops this module.
+
+# this was generated with npxy_make_font.py
+
+# font = one string per row, bottom row first, 'X' = pixel on
+# chars = char:(char,width,column index), plus 'height'
+
+font = ['  X  XXXX  XX XXX XXXXX    XXXX  XXXX XX X  XXXXXX   XX  X XX X    X XX  X XX   X   XX   X  X   XX   X  X  XXXX XXX XXXXXXXX XXX     X XXX  XXX  X    XXX  XXX         XXXXXX   X XX        X XXX       XXX    XX    XX X XX XX   XX  XXX     XX  X         X          X       X  ', '  X  XX  XX  XX  XX   X   X  XX  X X X  XX  XX   X   XX  XX  XX   X X X  XX  X  X  X  X X X XX XXX   X  X  X   X   X X  X   X   X    XX   XX   X X   X   XX   X        X    X  XX X X        X   X X X X X XX  XX   X  X XXX XXX X  X        X  X XX     XXXXX   XX   XXXXX       ', '  X  XX  XX   X  XX   X   X  XX  X X    XX X X   X   XX  XX  XX   X  XX X    X  X  X  XX   XX X X X X   X   X  X   X X   X      X    X    XX   X X   X   X    X     XXXX    X X      X      XX    XXXXX  X X X      X   XXXX XXXX    X    X  X  X X     X     X X  X X     X   X  ', '  XXXXXXX X   X  XXXX XXX X XXXXXX X    XXX  X   X   XX  XX  XXXX X  XXXX  XX   X  X  XX   XX   X  X    X    X X   X X    X   XX XXXXXXXXX XXXX   X   XXX  XXXX  XXX   X    X X      X   XXXXX XX  X X  XXX   X      XX     X   X    X   XXXXX  XX     X       XX  XX       X  X  ', '  X  XX  XX   X  XX   X   X   X  X X    XXX  X   X X XX XXX  XX  XX  XX  XX     X  X  XX   XX   X X X  X X    XX   X X     X    XX   XX    X       X X   XX   X     XXXX    X X X    X XXX  XX X X X X X X     X    X  X XXX XXXX    X    X  X  X XX    X     X X  X X     X    X ', '  X  XX  XX  XX  XX   X   X  XX  X X    XX X X   XX XXXX XX  XX  XX  XX  XX  X  X  X  XX   XX   XX   XX   X   XX   XXX X   XX   XX   XX    X   X    XX   XX   X X      X    XX   X    X     XX   XXXXXXX X XXX  XX XX  X XXX XXX X  X        X  X X X X  XXXXX   XX   XXXXX  X   X', '   XX XXX  XX XXX XXXXXXXX XX X  XXXX  XXX  XX   X   XX  X XX XXX  XX XXX  XX XXXXXX  XX   XX   XX   XX   XXXXX XXX  X  XXX  XXX     XXXXXX XXX XXXXX XXX  XXX X       XXXXXX    X          X XXX  X X  XXX XX    X  XX   XX XX   XX          XX  X X X   X              X    XXX ']
+chars = {'height': 7, ' ': (' ', 2, 0), 'A': ('A', 4, 2), 'B': ('B', 4, 6), 'C': ('C', 4, 10), 'D': ('D', 4, 14), 'E': ('E', 4, 18), 'F': ('F', 4, 22), 'G': ('G', 4, 26), 'H': ('H', 4, 30), 'I': ('I', 3, 34), 'J': ('J', 4, 37), 'K': ('K', 4, 41), 'L': ('L', 4, 45), 'M': ('M', 5, 49), 'N': ('N', 4, 54), 'O': ('O', 4, 58), 'P': ('P', 4, 62), 'Q': ('Q', 4, 66), 'R': ('R', 4, 70), 'S': ('S', 4, 74), 'T': ('T', 5, 78), 'U': ('U', 4, 83), 'V': ('V', 5, 87), 'W': ('W', 5, 92), 'X': ('X', 5, 97), 'Y': ('Y', 5, 102), 'Z': ('Z', 4, 107), '0': ('0', 5, 111), '1': ('1', 3, 116), '2': ('2', 5, 119), '3': ('3', 5, 124), '4': ('4', 5, 129), '5': ('5', 5, 134), '6': ('6', 5, 139), '7': ('7', 5, 144), '8': ('8', 5, 149), '9': ('9', 5, 154), '`': ('`', 2, 159), '-': ('-', 3, 161), '=': ('=', 3, 164), '[': ('[', 3, 167), ']': (']', 3, 170), '\\': ('\\', 3, 173), ';': (';', 1, 176), "'": ("'", 1, 177), ',': (',', 1, 178), '.': ('.', 1, 179), '/': ('/', 3, 180), '~': ('~', 5, 183), '!': ('!', 1, 188), '@': ('@', 5, 189), '#': ('#', 5, 194), '$': ('$', 5, 199), '%': ('%', 5, 204), '^': ('^', 3, 209), '&': ('&', 5, 212), '*': ('*', 7, 217), '(': ('(', 3, 224), ')': (')', 3, 227), '_': ('_', 3, 230), '+': ('+', 3, 233), '{': ('{', 3, 236), '}': ('}', 3, 239), '|': ('|', 1, 242), ':': (':', 1, 243), '"': ('"', 3, 244), '<': ('<', 11, 247), '>': ('>', 11, 258), '?': ('?', 5, 269)}
@@ -0,0 +1,32 @@
+# npxy_viper.py
+
+# Native (viper) code for the NPXY hot paths.
+# It is only imported if the port has the viper emitter,
+# otherwise npxy.py uses its Python versions.
+
+import micropython
+
+# out[i] = lut[src[i]] for the whole buffer (NPXY.write brightness)
+# src may be out
+@micropython.viper
+def lut_copy(out,src,lut):
+    o = ptr8(out)
+    s = ptr8(src)
+    t = ptr8(lut)
+    n = int(len(out))
+    for i in range(n):
+        o[i] = t[s[i]]
+
+# out[pixel] = layer[pixel] where alpha[pixel] (NPXY.compose)
+# c = bytes per pixel
+@micropython.viper
+def layer_copy(out,layer,alpha,c:int):
+    o = ptr8(out)
+    l = ptr8(layer)
+    a = ptr8(alpha)
+    n = int(len(alpha))
+    for p in range(n):
+        if a[p]:
+            i = p*c
+            for k in range(c):
+                o[i+k] = l[i+k]
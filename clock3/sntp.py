@@ -0,0 +1,281 @@
+# sntp.py = simple network time (SNTP) client
+
+# NOTE: these functions require a network connection
+# see nettools.py for options/suggestions
+
+# notify
+print('LOAD: sntp.py')
+
+# One UDP round trip per server, one 48 byte buffer for everything.
+# The request goes to all servers at once, the first good answer wins.
+
+# query(servers,timeout=1000) = blocking
+# query_async(servers,timeout=1000) = same, waits with asyncio
+
+# return = (ms,ticks,rtt,server) or None
+#   ms     = time (UTC, ms since the time.time() epoch) at ticks
+#   ticks  = time.ticks_ms() when the answer arrived
+#   rtt    = round trip (ms), less the server's own time
+#   server = the server that answered
+# the time now = ms + time.ticks_diff(time.ticks_ms(),ticks)
+
+# The time is corrected for the round trip, i.e. the answer is
+# taken to have spent half of the network time on the way back.
+
+# For testing, serve() is a stand-in SNTP server (host or board):
+#   python3 sntp.py serve [port] [offset seconds] [delay ms]
+#   python3 sntp.py query [host:port ...]
+
+# imports
+import time, struct
+import socket # actually imports usocket
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    from uselect import poll,POLLIN
+except ImportError:
+    from select import poll,POLLIN
+
+# seconds from 1900 (NTP) to the time.time() epoch (2000 or 1970)
+if time.gmtime(0)[0] == 2000:
+    EPOCH = 3155673600
+else:
+    EPOCH = 2208988800
+
+# the packet buffer (request and answer)
+buf = bytearray(48)
+
+# resolved addresses, server: (address,ticks_ms when resolved)
+# pool servers change, so an entry is looked up again after
+# address_ttl, or right away after a query got no answer
+addresses = {}
+address_ttl = 3600000 # ms
+
+# make the socket and send the request to all servers
+def send(servers):
+
+    # resolve first, a DNS error then leaves no socket open
+    targets = []
+    for server in servers:
+        address,ticks = addresses.get(server,(None,0))
+        if address is None or time.ticks_diff(time.ticks_ms(),ticks) > address_ttl:
+            host,port = server,123
+            if ':' in server:
+                host,port = server.split(':',1)
+                port = int(port)
+            address = socket.getaddrinfo(host,port,0,socket.SOCK_DGRAM)[0][-1]
+            addresses[server] = address,time.ticks_ms()
+        targets.append(address)
+
+    s = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    s.setblocking(False)
+
+    # tag = ticks and server index, sent as the transmit time
+    # (the server returns it as the originate time)
+    sent = time.ticks_ms()
+    for i in range(len(servers)):
+        for x in range(48):
+            buf[x] = 0
+        buf[0] = 0x1B # version 3, client
+        struct.pack_into('>II',buf,40,sent,i)
+        try:
+            s.sendto(buf,targets[i])
+        except OSError as e:
+            print('SNTP:',servers[i],repr(e))
+
+    return s,sent
+
+# forget the addresses of servers that did not answer
+def forget(servers):
+
+    for server in servers:
+        addresses.pop(server,None)
+
+# read an answer into buf, return the result or None
+def receive(s,servers,sent):
+
+    try:
+        if hasattr(s,'recv_into'):
+            size = s.recv_into(buf)
+        else:
+            size = s.readinto(buf)
+    except OSError:
+        return None
+    ticks = time.ticks_ms()
+
+    # check it is an answer to this request
+    if not size or size < 48:
+        return None
+    mode,stratum = buf[0] & 7,buf[1]
+    tag,index = struct.unpack_from('>II',buf,24)
+    if mode != 4 or not stratum or tag != sent or index >= len(servers):
+        return None
+
+    # server receive and transmit times
+    s2,f2,s3,f3 = struct.unpack_from('>IIII',buf,32)
+    held = (s3-s2)*1000 + ((f3-f2)*1000 >> 32)
+
+    # round trip (from the send), less the server's time
+    rtt = max(0,time.ticks_diff(ticks,sent)-held)
+
+    # time at ticks, half the network time after transmit
+    ms = (s3-EPOCH)*1000 + (f3*1000 >> 32) + rtt//2
+
+    return ms,ticks,rtt,servers[index]
+
+# blocking query, timeout = ms
+def query(servers,timeout=1000):
+
+    if type(servers) == str:
+        servers = [servers]
+    s,sent = send(servers)
+    try:
+        poller = poll()
+        poller.register(s,POLLIN)
+        while 1:
+            wait = timeout - time.ticks_diff(time.ticks_ms(),sent)
+            if wait <= 0 or not poller.poll(wait):
+                forget(servers)
+                return None
+            result = receive(s,servers,sent)
+            if result:
+                return result
+    finally:
+        s.close()
+
+# asyncio query, timeout = ms
+async def query_async(servers,timeout=1000,interval=10):
+
+    # interval = ms between looks for an answer
+
+    if type(servers) == str:
+        servers = [servers]
+    s,sent = send(servers)
+    try:
+        while time.ticks_diff(time.ticks_ms(),sent) < timeout:
+            result = receive(s,servers,sent)
+            if result:
+                return result
+            await asyncio.sleep(interval/1000)
+        forget(servers)
+        return None
+    finally:
+        s.close()
+
+# time (ms since the epoch) to a machine.RTC().datetime tuple
+def rtc_tuple(ms,utc_offset=0,dst=None):
+
+    # utc_offset = hours (e.g. -5 = US Eastern)
+    # dst = None, or 'us' or 'eu' daylight saving time rules
+
+    year,month,day,hour,minute,second,weekday,yearday = time.gmtime(local_ms(ms,utc_offset,dst)//1000)[:8]
+
+    return (year,month,day,weekday,hour,minute,second,0)
+
+# UTC time (ms since the epoch) to local time (ms since the epoch)
+def local_ms(ms,utc_offset=0,dst=None):
+
+    ms += int(utc_offset*3600000)
+    if dst and is_dst((ms//1000)-int(utc_offset*3600),utc_offset,dst):
+        ms += 3600000
+
+    return ms
+
+# daylight saving time (secs = UTC seconds since the epoch)
+def is_dst(secs,utc_offset,dst):
+
+    year = time.gmtime(secs)[0]
+
+    # start and end (UTC seconds)
+    if dst == 'us':
+        # 2nd Sunday March to 1st Sunday November, 2am local
+        start = sunday(year,3,8) + 2*3600 - int(utc_offset*3600)
+        end = sunday(year,11,1) + 1*3600 - int(utc_offset*3600)
+    else:
+        # last Sunday March to last Sunday October, 1am UTC
+        start = sunday(year,3,25) + 3600
+        end = sunday(year,10,25) + 3600
+
+    return start <= secs < end
+
+# first Sunday on or after year-month-day (UTC seconds at 0:00)
+def sunday(year,month,day):
+
+    secs = seconds(year,month,day)
+    weekday = time.gmtime(secs)[6] # 0 = Monday
+
+    return secs + ((6-weekday)%7)*86400
+
+# date and time to seconds since the epoch (no time zone, like time.gmtime)
+def seconds(year,month,day,hour=0,minute=0,second=0):
+
+    # days since 1970-01-01
+    if month <= 2:
+        year -= 1
+    era = year//400
+    yoe = year - era*400
+    doy = (153*(month+(9 if month <= 2 else -3))+2)//5 + day - 1
+    days = era*146097 + yoe*365 + yoe//4 - yoe//100 + doy - 719468
+
+    # to the time.time() epoch
+    if EPOCH == 3155673600:
+        days -= 10957
+
+    return days*86400 + hour*3600 + minute*60 + second
+
+# stand-in SNTP server (answers with this machine's time)
+def serve(port=12300,offset=0,delay=0,count=None):
+
+    # offset = seconds to add to the time
+    # delay = ms to hold each request (and say so, like a server would)
+    # count = answers to send, None = forever
+
+    s = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    s.bind(socket.getaddrinfo('0.0.0.0',port)[0][-1])
+    print('SNTP: serving on',port)
+
+    answer = bytearray(48)
+    sent = 0
+    try:
+        while count is None or sent < count:
+            request,address = s.recvfrom(48)
+            received = ntp_time(offset)
+            if delay:
+                time.sleep(delay/1000)
+            answer[0] = 0x24 # version 4, server
+            answer[1] = 1 # stratum
+            answer[24:32] = request[40:48]
+            answer[32:40] = received
+            answer[40:48] = ntp_time(offset)
+            s.sendto(answer,address)
+            sent += 1
+    finally:
+        s.close()
+
+# NTP timestamp (8 bytes) of this machine's time
+def ntp_time(offset=0):
+
+    if hasattr(time,'time_ns'):
+        ns = time.time_ns()
+    else:
+        ns = time.time()*1000000000
+    secs,ns = divmod(ns,1000000000)
+
+    return struct.pack('>II',int(secs+offset+EPOCH),int(ns*4294967296//1000000000))
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['serve']:
+        args = [int(x) for x in sys.argv[2:5]]
+        serve(*args)
+    elif sys.argv[1:2] == ['query']:
+        if not hasattr(time,'ticks_ms'):
+            import npsim
+            npsim.install(False,None,False)
+        result = query(sys.argv[2:] or ['pool.ntp.org'])
+        print('SNTP:',result)
+        if result:
+            print('SNTP:',rtc_tuple(result[0]))
@@ -11,26 +11,30 @@ print('LOAD: nettools_wget.py')
 # imports
 import time,network,gc
 import socket, ssl # actually imports usocket and ussl
-from uselect import poll,POLLIN,POLLHUP,POLLERR
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    from uselect import poll,POLLIN,POLLHUP,POLLERR
+except ImportError:
+    from select import poll,POLLIN,POLLHUP,POLLERR
+try:
+    import deflate # MicroPython 1.21+
+except ImportError:
+    deflate = None
+try:
+    import zlib
+except ImportError:
+    zlib = None
+try:
+    from io import IOBase # a Python stream for deflate/zlib to read
+except ImportError:
+    IOBase = object
 gc.collect()
   
-# make a GET request to URL
-def wget(url,outfile=None,show_data=False,return_data=True,max_data=10240):
-
-    # MUST be connected to a network AP first
-
-    # url         = [http[s]://]host[:port][/path][?variables] = only host is required
-    #               HTTPS must start URL with "https://" or specify port 443
-    # outfile     = write return data to this file, None = don't
-    # show_data   = print return data to stdout, False = don't
-    # return_data = keep data in memory and return at end of function
-    # max_data    = maximum content length to keep in bytes
-
-    # return = if return_data = ([list or (header,value) tuples],b'content as bytes')
-    #                    else = ([],b'')
-
-    # clear memory
-    gc.collect()
+# split URL into (http,host,port,path)
+def split_url(url):
 
     # get address variables
     http = 'http'
@@ -46,15 +50,12 @@ def wget(url,outfile=None,show_data=False,return_data=True,max_data=10240):
     if ":" in host:
         host,port = host.split(':',1)
         port = int(port)
-    if show_data:
-        print('-'*48)
-        print('WGET:',[http,host,port,path])
 
-    # open output
-    if outfile:
-        o = open(outfile,'wb')
+    return http,host,port,path
+
+# make a socket to host (and wrap it for https)
+def connect(http,host,port):
 
-    # make socket
     s = socket.socket()
     s.connect(socket.getaddrinfo(host,port,0,socket.SOCK_STREAM)[0][-1])
     s.setblocking(False)
@@ -63,93 +64,679 @@ def wget(url,outfile=None,show_data=False,return_data=True,max_data=10240):
     if http == 'https' or port == 443:
         s = ssl.wrap_socket(s)
 
-    # write GET request
-    s.write(b'GET /{} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(path,host))
+    return s
 
-    # set up polling
-    poller = poll()
-    poller.register(s,POLLIN)
+#-----------------------------------------------
+# keep-alive connections
+#-----------------------------------------------
 
-    # read headers
-    headers = []
-    content_len = 1 # will get at least 1 read if cl not specified
-    if show_data:
-        print('-'*48)
+# With keep=True, sockets are put back here after a response that
+# ended on a known boundary (Content-Length), and reused for the next
+# request to the same (http,host,port). That saves the DNS lookup, the
+# TCP connect and, most of all, the SSL handshake (seconds on an ESP8266).
+
+# It is opt-in: an idle socket (and its SSL buffers, tens of KB) stays
+# until the next request, pool_expire(), pool_close(), or a disconnect
+# (nettools closes the pool). Call pool_expire() now and then if
+# requests can be far apart.
+
+pool = {} # (http,host,port): [(socket,ticks when put back),...]
+pool_max = 2 # most idle sockets kept (all hosts)
+pool_idle = 20000 # ms an idle socket is kept
+
+# get a socket for (http,host,port), return (socket,reused)
+def pool_get(key):
+
+    pool_expire()
+
+    # an idle socket that has data (or hung up) is stale
+    idle = pool.get(key)
+    while idle:
+        s = idle.pop()[0]
+        poller = poll()
+        poller.register(s,POLLIN)
+        if not poller.poll(0):
+            return s,True
+        s.close()
+
+    return connect(*key),False
+
+# put a socket back (after a complete response)
+def pool_put(key,s):
+
+    pool.setdefault(key,[]).append((s,time.ticks_ms()))
+
+    # over the limit, close the oldest (ticks wrap, so by age)
+    now = time.ticks_ms()
     while 1:
-        polldata = poller.poll(10000) # initial timeout in ms
-        if not polldata:
-            if show_data:
-                print('\n<NO_DATA>')
+        idle = [(time.ticks_diff(now,ticks),key) for key,sockets in pool.items() for x,ticks in sockets]
+        if len(idle) <= pool_max:
             break
-        elif polldata[0][1] in (POLLHUP,POLLERR):
-            if show_data:
-                print('\n<POLLHUP_POLLERR>')
+        age,key = max(idle)
+        pool[key].pop(0)[0].close()
+        if not pool[key]:
+            del pool[key]
+
+# close idle sockets older than pool_idle
+def pool_expire():
+
+    now = time.ticks_ms()
+    for key in list(pool):
+        sockets = pool[key]
+        while sockets and time.ticks_diff(now,sockets[0][1]) > pool_idle:
+            sockets.pop(0)[0].close()
+        if not sockets:
+            del pool[key]
+
+# close all idle sockets (e.g. before a network disconnect)
+def pool_close():
+
+    for sockets in pool.values():
+        for s,ticks in sockets:
+            s.close()
+    pool.clear()
+
+#-----------------------------------------------
+# response headers
+#-----------------------------------------------
+
+# The status line and headers are read in blocks into one buffer
+# (not a line at a time), then kept as a single bytes object.
+# Lines are only located, and a value is only decoded when asked for.
+
+# header buffer (reused), most responses fit
+# a larger head is read into a bigger buffer for that response only,
+# doubled as needed up to head_max bytes (then ValueError)
+head = bytearray(2048)
+head_max = 16384
+
+# find the blank line after the headers in buf[:filled]
+def head_end(buf,start,filled):
+
+    # start = where new data starts (the search backs up to catch a split mark)
+    # return = (end of the headers,start of the content) or None
+    # (a MicroPython bytearray has no find, so this searches a bytes
+    #  copy of the new data only)
+
+    low = max(0,start-3)
+    tail = bytes(memoryview(buf)[low:filled])
+
+    found = None
+    for mark in (b'\r\n\r\n',b'\n\n'):
+        x = tail.find(mark)
+        if x != -1 and (found is None or low+x < found[0]):
+            found = low+x,low+x+len(mark)
+    return found
+
+class Headers:
+
+    # headers.status  = int, e.g. 200 (0 if the status line is bad)
+    # headers.reason  = str, e.g. 'OK'
+    # headers.version = str, e.g. 'HTTP/1.1'
+    # headers.get(name,default=None) = str value (name is case-insensitive)
+    # headers[name], name in headers, headers.items() = like a dict
+    # headers.length() = Content-Length as int, or None
+
+    def __init__(self,data=None):
+
+        self.fill(data or b'')
+
+    def fill(self,data):
+
+        # data = bytes, the status line and header lines (no blank line)
+
+        self.head = data
+        self.lines = [] # (start,end) of each line, no line ends
+        self.values = {} # decoded values by lower case name
+
+        # find lines
+        start = 0
+        size = len(data)
+        while start < size:
+            x = data.find(b'\n',start)
+            if x == -1:
+                x = size
+            end = x
+            if end > start and data[end-1] == 13: # \r
+                end -= 1
+            self.lines.append((start,end))
+            start = x+1
+
+        # status line
+        self.version,self.status,self.reason = '',0,''
+        if self.lines:
+            parts = data[:self.lines[0][1]].split(None,2)
+            if len(parts) >= 2 and parts[1].isdigit():
+                self.version = parts[0].decode()
+                self.status = int(parts[1])
+                if len(parts) == 3:
+                    self.reason = parts[2].decode()
+
+    def get(self,name,default=None):
+
+        name = name.lower()
+        if name in self.values:
+            return self.values[name]
+
+        key = name.encode()
+        size = len(key)
+        data = self.head
+        for start,end in self.lines[1:]:
+            if data[start+size:start+size+1] == b':' and data[start:start+size].lower() == key:
+                value = self.values[name] = data[start+size+1:end].strip().decode()
+                return value
+        return default
+
+    def __getitem__(self,name):
+
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self,name):
+
+        return self.get(name) is not None
+
+    def __len__(self):
+
+        return max(0,len(self.lines)-1)
+
+    def items(self):
+
+        # (lower case name,value) for every header line, in order
+        data = self.head
+        for start,end in self.lines[1:]:
+            x = data.find(b':',start,end)
+            if x != -1:
+                yield data[start:x].strip().lower().decode(),data[x+1:end].strip().decode()
+
+    def raw(self):
+
+        # the lines as bytes (status line first)
+        return [self.head[start:end] for start,end in self.lines]
+
+    def length(self):
+
+        value = self.get('content-length')
+        if value and value.isdigit():
+            return int(value)
+        return None
+
+#-----------------------------------------------
+# content
+#-----------------------------------------------
+
+# Each of these takes chunks (memoryviews) and yields chunks,
+# so the content passes through without being kept.
+
+# raw content, as read from the socket
+def raw_chunks(poller,readinto,view,first,remaining,timeout,end):
+
+    # view      = memoryview to read into
+    # first     = memoryview, content read with the headers
+    # remaining = Content-Length, None = read to the close
+    # end       = [False], set to [True] if the length was all read
+
+    if remaining is not None:
+        first = first[:remaining]
+        remaining -= len(first)
+    if first:
+        yield first
+
+    size = len(view)
+    while remaining is None or remaining > 0:
+        polldata = poller.poll(timeout)
+        if not polldata or polldata[0][1] in (POLLHUP,POLLERR):
             break
+        if remaining is None or remaining >= size:
+            read = readinto(view)
         else:
-            line = s.readline()[:256]
-            if not line or line == b'\r\n':
-                if outfile:
-                    o.write(b'\r\n')
-                if show_data:
-                    print()
+            read = readinto(view[:remaining])
+        if read is None: # no data after all (non-blocking)
+            continue
+        if not read: # closed
+            break
+        if remaining is not None:
+            remaining -= read
+        yield view[:read]
+
+    end[0] = remaining == 0
+
+# Transfer-Encoding: chunked, the data is passed on in place
+def unchunk(chunks,end):
+
+    # each chunk is a hex size line, the data, and a line end,
+    # the last is size 0 followed by (optional) trailers and a blank line
+    # end = [False], set to [True] after the last chunk
+
+    size = 0 # data left in this chunk
+    line = bytearray() # the line so far (sizes and trailers only)
+    state = 0 # 0 = size line, 1 = data, 2 = line end after data, 3 = trailers
+
+    for chunk in chunks:
+        x = 0
+        length = len(chunk)
+        while x < length:
+
+            # data
+            if state == 1:
+                read = min(size,length-x)
+                yield chunk[x:x+read]
+                x += read
+                size -= read
+                if not size:
+                    state = 2
+                continue
+
+            # lines
+            c = chunk[x]
+            x += 1
+            if c != 10: # \n
+                if len(line) >= 256:
+                    raise ValueError('bad chunk line')
+                line.append(c)
+                continue
+            text = bytes(line).strip()
+            line = bytearray()
+            if state == 0:
+                size = int(text.split(b';')[0].decode(),16)
+                state = 1 if size else 3
+            elif state == 2:
+                state = 0
+            elif not text: # end of trailers
+                end[0] = True
+                return
+
+# a stream over chunks (for deflate.DeflateIO and zlib.DecompIO)
+class ChunkStream(IOBase):
+
+    def __init__(self,chunks):
+
+        self.chunks = chunks
+        self.chunk = None
+
+    def readinto(self,buf):
+
+        while not self.chunk:
+            try:
+                self.chunk = next(self.chunks)
+            except StopIteration:
+                return 0
+        read = min(len(buf),len(self.chunk))
+        buf[:read] = self.chunk[:read]
+        self.chunk = self.chunk[read:]
+        return read
+
+    def read(self,size=-1):
+
+        buf = bytearray(size if size > 0 else 512)
+        return buf[:self.readinto(buf)]
+
+# can decompress (the wget compressed option)
+def can_decompress():
+
+    return bool(deflate or (zlib and (hasattr(zlib,'decompressobj') or hasattr(zlib,'DecompIO'))))
+
+# Content-Encoding: gzip or deflate, streaming decompression into view
+def decompress(chunks,encoding,view):
+
+    # NOTE: the window (up to 32K, from the stream header) is allocated
+    # while decompressing, the content itself is never all in memory
+
+    gzip = encoding == 'gzip'
+
+    # CPython
+    if zlib and hasattr(zlib,'decompressobj'):
+        d = zlib.decompressobj(31 if gzip else 15)
+        for chunk in chunks:
+            data = d.decompress(chunk)
+            if data:
+                yield memoryview(data)
+        data = d.flush()
+        if data:
+            yield memoryview(data)
+        return
+
+    # MicroPython
+    stream = ChunkStream(chunks)
+    if deflate:
+        f = deflate.DeflateIO(stream,deflate.GZIP if gzip else deflate.ZLIB)
+    else:
+        f = zlib.DecompIO(stream,31 if gzip else 15)
+    while 1:
+        read = f.readinto(view)
+        if not read:
+            break
+        yield view[:read]
+
+    # read to the end of the content (e.g. the last chunk)
+    for chunk in chunks:
+        pass
+
+#-----------------------------------------------
+# requests
+#-----------------------------------------------
+
+# read the status line and headers into the header buffer
+def read_head(s,poller,readinto):
+
+    # return = (buffer,end of the headers,start of the content,bytes read) or None
+    # (buffer = head, or a bigger one for a large head)
+
+    buf = head
+    hview = memoryview(buf)
+    filled = 0
+    found = None
+    while not found:
+        if filled == len(buf):
+            if len(buf) >= head_max:
+                raise ValueError('headers over head_max')
+            bigger = bytearray(min(len(buf)*2,head_max))
+            bigger[:filled] = hview[:filled]
+            buf = bigger
+            hview = memoryview(buf)
+        polldata = poller.poll(10000) # initial timeout in ms
+        if not polldata or polldata[0][1] in (POLLHUP,POLLERR):
+            return None
+        read = readinto(hview[filled:])
+        if read is None: # no data after all (non-blocking)
+            continue
+        if not read: # closed
+            return None
+        found = head_end(buf,filled,filled+read)
+        filled += read
+
+    return buf,found[0],found[1],filled
+
+# make a GET request to URL, yield the content in chunks
+def wget_chunks(url,headers=None,buffer=512,timeout=1000,keep=False,compressed=False):
+
+    # MUST be connected to a network AP first
+
+    # url     = see wget
+    # headers = a Headers(), it is filled before the first chunk
+    # buffer  = chunk size in bytes, or a bytearray to read into
+    # timeout = ms to wait for more content (10 sec for the headers)
+    # keep    = True = use (and return) a keep-alive socket from the pool (see pool)
+    # compressed = True = ask for gzip or deflate, and decompress it
+
+    # yields = memoryview chunks of the buffer (the same buffer every time)
+    #          a chunk is only good until the next one is read,
+    #          so use it (or copy it) before asking for the next
+    #          (the first chunk can be the content read with the
+    #           headers, from the header buffer, up to its size)
+
+    # Chunked content is passed on without the chunk framing, and it
+    # ends at the last chunk (no waiting for a timeout or the close).
+
+    # The content is never all in memory, so it can be larger than the heap.
+    # Stopping early (break or close()) closes the socket.
+    # Otherwise, with keep, it goes back to the pool if the response
+    # ended by its Content-Length or last chunk and the server did not
+    # ask to close.
+
+    # one buffer for all reads
+    if type(buffer) == int:
+        buffer = bytearray(buffer)
+    view = memoryview(buffer)
+
+    # get address variables
+    http,host,port,path = split_url(url)
+
+    # make socket (or reuse one)
+    key = http,host,port
+    if keep:
+        s,reused = pool_get(key)
+    else:
+        s,reused = connect(http,host,port),False
+    done = False
+
+    try:
+
+        # write GET request, read the headers
+        # (a reused socket the server has since closed gets no answer,
+        #  so try once more on a new one)
+        compressed = compressed and can_decompress()
+        request = 'GET /{} HTTP/1.1\r\nHost: {}\r\nConnection: {}\r\n{}\r\n'.format(
+            path,host,'keep-alive' if keep else 'close',
+            'Accept-Encoding: gzip, deflate\r\n' if compressed else '').encode()
+        while 1:
+            readinto = getattr(s,'readinto',None) or s.recv_into
+            poller = poll()
+            poller.register(s,POLLIN)
+            try:
+                s.write(request)
+                found = read_head(s,poller,readinto)
+            except OSError:
+                if not reused:
+                    raise
+                found = None
+            if found or not reused:
                 break
+            s.close()
+            s,reused = connect(http,host,port),False
+        if not found:
+            return
+        buf,end,start,filled = found
+        hview = memoryview(buf)
+        if headers is None:
+            headers = Headers()
+        headers.fill(bytes(hview[:end]))
+
+        # content (read into the header buffer if it is to be decompressed)
+        end = [False]
+        remaining = headers.length()
+        chunked = 'chunked' in (headers.get('transfer-encoding') or '').lower()
+        encoding = (headers.get('content-encoding') or '').lower()
+        if headers.status in (204,304) or 100 <= headers.status < 200:
+            remaining,chunked = 0,False
+        elif chunked:
+            remaining = None
+        decoding = compressed and encoding in ('gzip','deflate')
+        chunks = raw_chunks(poller,readinto,hview if decoding else view,hview[start:filled],remaining,timeout,
+                            [False] if chunked else end)
+        if chunked:
+            chunks = unchunk(chunks,end)
+        if decoding:
+            chunks = decompress(chunks,encoding,view)
+        for chunk in chunks:
+            yield chunk
+
+        # reusable if the end was found by the length or last chunk
+        # (HTTP/1.1 keeps the socket open unless told otherwise)
+        if keep and end[0]:
+            connection = (headers.get('connection') or '').lower()
+            if headers.version == 'HTTP/1.1':
+                done = connection != 'close'
             else:
-                if return_data:
-                    headers.append(line.strip())
-                if outfile:
-                    o.write(line)
-                if show_data:
-                    print('HEADER:',line)
-                if line.startswith(b'Content-Length:'):
-                    line = line[15:].strip()
-                    if line.isdigit():
-                        content_len = int(line)
-            del line
-        del polldata
-
-    # read content
-    data = b''
-    data_len = 0
-    content_len = min(content_len,max_data)
+                done = connection == 'keep-alive'
+
+    # keep or close socket
+    finally:
+        if done:
+            pool_put(key,s)
+        else:
+            s.close()
+
+# make a GET request to URL
+def wget(url,outfile=None,show_data=False,return_data=True,max_data=10240,callback=None,buffer=512,keep=False,compressed=False):
+
+    # MUST be connected to a network AP first
+
+    # url         = [http[s]://]host[:port][/path][?variables] = only host is required
+    #               HTTPS must start URL with "https://" or specify port 443
+    # outfile     = write return data to this file, None = don't
+    # show_data   = print return data to stdout, False = don't
+    # return_data = keep data in memory and return at end of function
+    # max_data    = maximum content length to read in bytes
+    # callback    = function called with each chunk (a memoryview), None = don't
+    # buffer      = read size in bytes (see wget_chunks)
+    # keep        = reuse keep-alive sockets (see wget_chunks)
+    # compressed  = ask for gzip/deflate content and decompress it (see wget_chunks)
+
+    # return = if return_data = (Headers(),bytearray(content))
+    #                    else = (Headers(),b'')
+
+    # The content is read in place (no copies), into one bytearray
+    # when the Content-Length is given (and it is not compressed).
+    # See wget_chunks for large content.
+
+    # clear memory
+    gc.collect()
+
+    # get address variables
     if show_data:
         print('-'*48)
-        print('DATA:',content_len)
-    while data_len < content_len:
-        polldata = poller.poll(1000) # 1 sec timeout post headers
-        if not polldata:
-            if show_data:
-                print('\n<END_OF_DATA>')
-            break
-        elif polldata[0][1] in (POLLHUP,POLLERR):
-            if show_data:
-                print('\n<POLLHUP_POLLERR>')
-            break
-        else:
-            read = s.read()
+        print('WGET:',split_url(url))
+
+    # open output
+    if outfile:
+        o = open(outfile,'wb')
+
+    # read
+    headers = Headers()
+    data = None
+    data_len = 0
+    chunks = wget_chunks(url,headers,buffer,keep=keep,compressed=compressed)
+    try:
+        for chunk in chunks:
+
+            # first chunk, headers are in
+            if data is None:
+                content_len = headers.length()
+                if compressed and headers.get('content-encoding'):
+                    content_len = None # that is the compressed length
+                if show_data:
+                    for line in headers.raw():
+                        print('HEADER:',line)
+                    print('-'*48)
+                    print('DATA:',content_len)
+                if outfile:
+                    o.write(headers.head+b'\r\n\r\n')
+                if return_data and content_len is not None:
+                    data = bytearray(min(content_len,max_data))
+                else:
+                    data = bytearray()
+
+            # keep to max_data
+            chunk = chunk[:max_data-data_len]
+            read = len(chunk)
             if return_data:
-                data += read
+                if data_len+read <= len(data):
+                    data[data_len:data_len+read] = chunk
+                else:
+                    data.extend(chunk)
             if outfile:
-                o.write(read)
+                o.write(chunk)
             if show_data:
-                print(read,end='')
-            data_len += len(read)
-            del read
-        del polldata
+                print(bytes(chunk),end='')
+            if callback:
+                callback(chunk)
+            data_len += read
+            del chunk
+            if data_len >= max_data and data_len != content_len: # (else done anyway)
+                break
+
+    # close socket and output
+    finally:
+        chunks.close()
+        if outfile:
+            o.close()
 
-    # close output
     if show_data:
         print()
         print('-'*48)
-    if outfile:
-        o.close()
-
-    # close socket
-    s.close()
 
     # clear memory
     gc.collect()
 
     # done
+    if not return_data:
+        return headers,b''
+    if data is None:
+        return headers,b''
+    if data_len < len(data):
+        data = data[:data_len]
     return headers,data
 
+# make a GET request to URL, waiting with asyncio (other tasks keep running)
+async def wget_async(url,timeout=10,max_data=10240):
+
+    # MUST be connected to a network AP first
+    # HTTP only (asyncio streams have no SSL on all ports)
+
+    # url      = see wget
+    # timeout  = seconds for the whole request
+    # max_data = maximum content length to keep in bytes
+
+    # return = (Headers(),bytearray(content))
+    #          raises OSError or asyncio.TimeoutError on failure
+
+    http,host,port,path = split_url(url)
+    if http == 'https' or port == 443:
+        raise ValueError('wget_async is HTTP only')
+
+    return await asyncio.wait_for(wget_stream(host,port,path,max_data),timeout)
+
+async def wget_stream(host,port,path,max_data):
+
+    # make connection
+    reader,writer = await asyncio.open_connection(host,port)
+
+    try:
 
+        # write GET request
+        writer.write('GET /{} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n'.format(path,host).encode())
+        await writer.drain()
+
+        # read headers (the stream buffers them)
+        lines = []
+        while 1:
+            line = await reader.readline()
+            if not line or not line.strip():
+                break
+            lines.append(line.rstrip())
+        headers = Headers(b'\r\n'.join(lines))
+        del lines
+        content_len = headers.length()
+        if content_len is None:
+            content_len = max_data # read to close if cl not specified
+
+        # read content (into one bytearray, in place if the stream can)
+        content_len = min(content_len,max_data)
+        data = bytearray(content_len)
+        view = memoryview(data)
+        readinto = getattr(reader,'readinto',None)
+        data_len = 0
+        while data_len < content_len:
+            end = min(data_len+512,content_len)
+            if readinto:
+                read = await readinto(view[data_len:end])
+            else:
+                read = await reader.read(end-data_len)
+                if read:
+                    view[data_len:data_len+len(read)] = read
+                read = len(read)
+            if not read:
+                break
+            data_len += read
+        del view
+        if data_len < content_len:
+            data = data[:data_len]
+
+        # chunked content (read to the close), take out the framing
+        if 'chunked' in (headers.get('transfer-encoding') or '').lower():
+            raw = memoryview(data)
+            data = bytearray()
+            for chunk in unchunk((raw,),[False]):
+                data.extend(chunk)
+            del raw
+
+    # close socket
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    # done
+    return headers,data